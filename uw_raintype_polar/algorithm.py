@@ -1,11 +1,12 @@
 from __future__ import division     #For python2 users only.
+import numpy as np
+import backends
+import profiler as prof
+import rtfunctions as rt
 
-def convsf(kmToFirstGate,kmBetweenGates,numRanges,numTimes,backgrndradius,maxConvRadius,sweep_used,dBZsweep,filenum,repeat,maskcell):
+def makemasks(kmToFirstGate,kmBetweenGates,numRanges,numTimes,backgrndradius,maxConvRadius,minR,maxR):
 
-    #Purpose: To make background and MIXED region masks and to compute background reflectivity.
-
-    import numpy as np
-    import rtfunctions as rt
+    #Purpose: To make the background and MIXED region masks for rings minR through maxR.
 
     halfnumTimes = np.int16(np.ceil(0.5*numTimes))
     #Make a map of the (azimuth, radius) coordinate system.
@@ -14,6 +15,34 @@ def convsf(kmToFirstGate,kmBetweenGates,numRanges,numTimes,backgrndradius,maxCon
     [X,Y] = rt.pol2cart(phi,R)
     del phi
 
+    #Create masks. One mask per ring of data (i.e. one mask per radius from center).
+    #maskcell are indices of  points within backgrndradius of a point at given radius from the radar site.
+    #convcell are indices of points within maxConvRadius-5 to maxConvRadius of a convective core.
+    #convcell[R,0] is the largest mask, and convcell[R,5] is the smallest mask for weaker convective echoes.
+    #Any echoes that end up getting masked by convcell (in def convectivecore) will be MIXED.
+    centerphi = halfnumTimes  #180
+    maskcell = np.empty([numRanges,1],dtype=object)
+    convcell = np.empty([numRanges,5],dtype=object)
+    #convcell = [[[],[],[],[],[]] for _ in range(numRanges)]
+    for R in range(minR,maxR+1):
+      #Only the range and azimuth window around the point that can fall within the mask radii is
+      #searched (see rt.radialdistancemask for the equivalent full-grid version).
+      indices = rt.ringmaskindices(R-1,centerphi-1,X,Y,backgrndradius,maxConvRadius)
+      #The masks are the indices of the points to be masked in the 1D (Fortran-order) arrays of
+      #data. After masking in another subroutine (convectivecore), these will be converted back to
+      #2D matrices.
+      centerval = np.ravel_multi_index((R-1,centerphi-1),(numRanges,numTimes),order="F")-1
+      maskcell[R] = [indices[0]-centerval]
+      for k in range(0,5):
+        convcell[R,k] = indices[k+1]-centerval
+
+    return(maskcell,convcell)
+
+
+def ringlimits(kmBetweenGates,numRanges,backgrndradius):
+
+    #Purpose: To find the innermost and outermost rings that are classified.
+
     #Any data within minR of the radar site will get NaNed out.
     minR = int(round(0.125/kmBetweenGates))
     if minR == 0:
@@ -22,201 +51,271 @@ def convsf(kmToFirstGate,kmBetweenGates,numRanges,numTimes,backgrndradius,maxCon
     #Any data beyond maxR of the radar size will also get NaNed out.
     maxR = int(round(numRanges-0.5*backgrndradius/kmBetweenGates))
 
-    #Create masks. One mask per ring of data (i.e. one mask per radius from center).
-    #Only do this if mask doesn't yet exist. Only needs to occur on first file in batch.
-    #maskcell are indices of  points within backgrndradius of a point at given radius from the radar site.
-    #convcell are indices of points within maxConvRadius-5 to maxConvRadius of a convective core.
-    #convcell[R,0] is the largest mask, and convcell[R,5] is the smallest mask for weaker convective echoes.
-    #Any echoes that end up getting masked by convcell (in def convectivecore) will be MIXED.
+    return(minR,maxR)
+
+
+def getmasks(kmToFirstGate,kmBetweenGates,numRanges,numTimes,backgrndradius,maxConvRadius,maskcache=None):
+
+    #Purpose: To get the background and MIXED region masks and the areal coverage of each point.
+    #If maskcache is the name of a directory, masks are loaded from (or saved to) a file there
+    #keyed by the radar geometry, so they are only built once for each geometry.
+
+    (minR,maxR) = ringlimits(kmBetweenGates,numRanges,backgrndradius)
+
+    if maskcache is not None:
+      key = rt.maskcachekey(numRanges,numTimes,kmToFirstGate,kmBetweenGates,backgrndradius,maxConvRadius)
+      masks = rt.loadmasks(maskcache,key,numRanges,numTimes)
+      if masks is not None:
+        (maskcell,convcell,sectorarea) = masks
+        return(maskcell,convcell,sectorarea,minR,maxR)
+
+    (maskcell,convcell) = makemasks(kmToFirstGate,kmBetweenGates,numRanges,numTimes,backgrndradius,maxConvRadius,minR,maxR)
+
+    #Compute the areal coverage of each data point. (This gets larger farther from radar.)
+    #It isn't wrapped around at 0 and 359 degrees (see rt.labelechoes).
+    sectorarea = np.empty([numRanges,numTimes])
+    sectorarea[:] = np.nan
+    for i in range (0,numRanges-1):
+      #sectorarea[i,:] = 1/360*np.pi*((kmBetweenGates*(i+1))**2-(kmBetweenGates*i)**2)
+      sectorarea[i,:] = 1/numTimes*np.pi*((kmBetweenGates*(i+1))**2-(kmBetweenGates*i)**2)
+
+    if maskcache is not None:
+      rt.savemasks(maskcache,key,maskcell,convcell,sectorarea,numRanges,numTimes)
+
+    return(maskcell,convcell,sectorarea,minR,maxR)
+
+
+#*********End mask production*********
+
+
+def convsf(kmToFirstGate,kmBetweenGates,numRanges,numTimes,backgrndradius,maxConvRadius,sweep_used,dBZsweep,filenum,repeat,maskcell,maskcache=None,bgengine='gather',bgcount=False,precision='double',packed=None,backend='reference',echothres=None):
+
+    #Purpose: To make background and MIXED region masks and to compute background reflectivity.
+    #maskcache is an optional directory in which masks are cached (see getmasks).
+    #bgengine selects how the background is computed: 'gather' (the original mask gather) or
+    #'prefixsum' (running sums along azimuth, same result to floating-point tolerance). If bgcount
+    #is True, the number of valid gates behind each background value is returned as well.
+    #precision = 'single' converts dBZsweep to float32 and computes Z and the background in float32
+    #(see convectivecore); 'double' leaves dBZsweep as it is and returns a float64 background.
+    #packed is (codes,lut) from cfrad_io.readsweep with packed = True, if dBZsweep was read that way.
+    #Z is then looked up in a table of the Z of every code rather than computed gate by gate.
+    #backend is the name of the backend (see backends.py) that computes the background.
+    #With echothres (weakechothres), the background is only computed at gates with at least echothres
+    #dBZ and next to them in azimuth, and is NaN elsewhere. convectivecore doesn't use it anywhere
+    #else, so the classification is the same, and a sweep with little echo takes a fraction of the
+    #time. (A core's mixed radius comes from the background one azimuth over when numTimes is odd,
+    #see makedBZcluster, hence the gates next to the echo.)
+
+    (minR,maxR) = ringlimits(kmBetweenGates,numRanges,backgrndradius)
+
+    #Create masks. Only do this if mask doesn't yet exist. Only needs to occur on first file in batch.
     if filenum != 0 and repeat == 0:
       #do nothing
       dummy = 0
       del dummy
     else:
-      centerphi = halfnumTimes  #180
-      maskcell = np.empty([numRanges,1],dtype=object)
-      convcell = np.empty([numRanges,5],dtype=object)
-      #convcell = [[[],[],[],[],[]] for _ in range(numRanges)]
-      for R in range(minR,maxR+1):
-        [mask,bgmask] = rt.radialdistancemask(X[R-1,centerphi-1],Y[R-1,centerphi-1],X,Y,backgrndradius,maxConvRadius)
-        [I,J] = np.where(bgmask==1)
-        [I2,J2] = np.where(mask>=1)
-        [I3,J3] = np.where(mask>=2)
-        [I4,J4] = np.where(mask>=3)
-        [I5,J5] = np.where(mask>=4)
-        [I6,J6] = np.where(mask>=5)
-        #To create the masks, convert the 2D matrices of data to 1D arrays. Find the indices
-        #of the 1D arrays that should be masked. After masking in another subroutine
-        #(convectivecore), these will be converted back to 2D matrices.
-        centerval = np.ravel_multi_index((R-1,centerphi-1),dBZsweep.shape,order="F")-1
-        maskcell[R] = [np.ravel_multi_index((I,J),bgmask.shape,order="F")-centerval]
-        convcell[R,0] = np.ravel_multi_index((I2,J2),mask.shape,order="F")-centerval
-        convcell[R,1] = np.ravel_multi_index((I3,J3),mask.shape,order="F")-centerval
-        convcell[R,2] = np.ravel_multi_index((I4,J4),mask.shape,order="F")-centerval
-        convcell[R,3] = np.ravel_multi_index((I5,J5),mask.shape,order="F")-centerval
-        convcell[R,4] = np.ravel_multi_index((I6,J6),mask.shape,order="F")-centerval
-
-      #Compute the areal coverage of each data point. (This gets larger farther from radar.)
-      sectorarea = np.empty([numRanges,numTimes])
-      sectorarea[:] = np.nan
-      for i in range (0,numRanges-1):
-        #sectorarea[i,:] = 1/360*np.pi*((kmBetweenGates*(i+1))**2-(kmBetweenGates*i)**2)
-        sectorarea[i,:] = 1/numTimes*np.pi*((kmBetweenGates*(i+1))**2-(kmBetweenGates*i)**2)
-      #sectorarea = np.concatenate((sectorarea[:,180:360],sectorarea,sectorarea[:,0:180]),axis=1)
-      sectorarea = np.concatenate((sectorarea[:,halfnumTimes:numTimes+1],sectorarea,sectorarea[:,0:halfnumTimes]),axis=1)
+      (maskcell,convcell,sectorarea,minR,maxR) = getmasks(kmToFirstGate,kmBetweenGates,numRanges,numTimes,backgrndradius,maxConvRadius,maskcache)
   
+    if precision == 'single':
+      dtype = np.float32
+      dBZsweep = dBZsweep.astype(dtype,copy=False)
+    elif precision == 'double':
+      dtype = np.float64
+    else:
+      raise ValueError('Unknown precision ' + str(precision) + '. Use single or double.')
+
     dBZsweep[0:minR+1,:] = np.nan       #NaN out reflectivity close to radar.
-    Zsweep = 10**(0.1*dBZsweep)         #Convert dBZ to Z.
+    if packed is None:
+      Zsweep = 10**(0.1*dBZsweep)       #Convert dBZ to Z.
+    else:
+      #Z of each code, computed as above, looked up for each gate. Gates NaNed out in dBZsweep since
+      #it was read (close to the radar, or by LDR or clutter) are NaNed out in Zsweep as well.
+      (codes,lut) = packed
+      Zsweep = (10**(0.1*lut.astype(dtype)))[codes]
+      Zsweep[np.isnan(dBZsweep)] = np.nan
 
     #Compute background reflectivity at each point.
 
-    #Allocate memory.
-    background = np.empty([numTimes,numRanges])
-    background[:] = np.nan
+    #Data at 0 and 359 degrees are continuous. Rather than wrapping a copy of the data around, the
+    #background functions index the sweep modulo its size (see rt.backgroundgather).
+    #(Z of a masked sweep is taken as its data, as the wrapped copy used to be.)
+    Zsweep = np.asarray(Zsweep)
+    if bgengine == 'prefixsum' or bgcount:
+      valid = ~np.isnan(Zsweep)
+    else:
+      valid = None
+    Zsweep[np.isnan(Zsweep)] = 0
 
-    #Wrap data around so that data at 0 and 359 degrees are continuous.
-    phi = np.array(range(halfnumTimes,halfnumTimes+numTimes))
-    Zsweepconcat = np.concatenate((Zsweep[:,halfnumTimes:numTimes+1],Zsweep,Zsweep[:,0:halfnumTimes]),axis=1)
-    Zsweepconcat[np.isnan(Zsweepconcat)] = 0
-    Zsweepconcat = np.reshape(Zsweepconcat,(np.size(Zsweepconcat),1), order="F")
+    #Gates the background is needed at.
+    needed = None
+    if echothres is not None:
+      echo = np.ma.getdata(dBZsweep) >= echothres
+      needed = echo | np.roll(echo,1,axis=1) | np.roll(echo,-1,axis=1)
+      del echo
 
     #Use the background mask created above to compute background Z.
-    for R in range(minR,maxR+1):
-      maskuse = maskcell[R][0]
-      background[0:numTimes,R] = np.mean(Zsweepconcat[maskuse[:,np.newaxis]+numRanges*(phi)+R],0)[:,0]
+    (background,count) = backends.get(backend).background(Zsweep,valid,maskcell,minR,maxR,numRanges,numTimes,dtype,bgengine,needed)
 
     #Just clearing memory.
-    del Zsweepconcat
+    del Zsweep,valid
 
     #Convert background Z to dBZ. 
     background[background == 0] = np.nan
     background = np.transpose(10*np.log10(background))
 
     if filenum == 0 or repeat == 1:
-      return(maskcell,convcell,background,sectorarea,dBZsweep,minR,maxR)
+      output = (maskcell,convcell,background,sectorarea,dBZsweep,minR,maxR)
     else:
-      return(background,dBZsweep,minR,maxR)
+      output = (background,dBZsweep,minR,maxR)
+    #Number of valid (non-NaN) gates that went into each background value, if asked for.
+    if bgcount:
+      output = output + (np.transpose(count),)
+    return output
 
 
 #*********End mask production and background calculation*********
 
 
-def convectivecore(background,refl,minZdiff,CS_CORE,ISO_CS_CORE,CONVECTIVE,STRATIFORM,MIXED,WEAK_ECHO,ISO_CONV_CORE,ISO_CONV_FRINGE,NO_ECHO,dBZformaxconvradius,maxConvRadius,weakechothres,deepcoszero,minsize,maxsize,startslope,shallowconvmin,truncZconvthres,mindbzuse,sectorarea,convcell,maxR,numRanges,numTimes,rtfill):
-
-  import numpy as np
-  import rtfunctions as rt
- 
-  #Allocate isCore, a matrix that contains whether a grid point contains a convective core
-  #and convsfmat, what will ultimately be the final rain-type classification.
-  isCore = np.ones(background.shape)
-  convsfmat = 10*np.ones((refl.shape),dtype=np.int)
-
-  #Allocate zDiff, the variable representing the excess over the background dBZ
-  #an echo must achieve to be considered a convective core.
-  zDiff = np.empty(refl.shape)
-  zDiff[:] = np.nan
-
-  #Compute zDiff. 
-  zDiff = 2.5 + minZdiff * np.cos((np.pi)*background/(2*deepcoszero))
-  zDiff[(background < 0)] = minZdiff 
+def convectivecore(background,refl,minZdiff,CS_CORE,ISO_CS_CORE,CONVECTIVE,STRATIFORM,MIXED,WEAK_ECHO,ISO_CONV_CORE,ISO_CONV_FRINGE,NO_ECHO,dBZformaxconvradius,maxConvRadius,weakechothres,deepcoszero,minsize,maxsize,startslope,shallowconvmin,truncZconvthres,mindbzuse,sectorarea,convcell,maxR,numRanges,numTimes,rtfill,timings=None,precision='double',labels=None,backend='reference'):
+
+  #If timings is a dictionary, the time spent labelling echo objects ('label'), in the rest of
+  #makedBZcluster ('cluster') and in the rest of this function ('mixed') is added to it. A
+  #profiler.Profiler also counts the echo objects ('echoes') and convective cores ('cores').
+  #With precision = 'single' (background and refl from convsf with precision = 'single'), the
+  #intermediates are float32 and isCore and the classes are int8, which cuts the memory used
+  #(peak memory by about a quarter on the fine_ragged case in benchmark.py). On the benchmark.py
+  #cases the float32 background differs from the float64 one by at most 4e-5 dBZ (3e-6 dBZ on
+  #average), so only gates that close to a threshold can change class; none did on those cases.
+  #labels is passed on to makedBZcluster (see there), so echo objects labelled once can be reused
+  #for other thresholds. backend is the name of the backend (see backends.py) that runs the cluster
+  #and mixed kernels.
+
+  kernels = backends.get(backend)
+
+  with prof.stage(timings,'mixed'):
+    #Allocate isCore, a matrix that contains whether a grid point contains a convective core
+    #and convsfmat, what will ultimately be the final rain-type classification.
+    if precision == 'single':
+      isCore = np.ones(background.shape,dtype=np.int8)
+      convsfmat = 10*np.ones((refl.shape),dtype=np.int8)
+    else:
+      isCore = np.ones(background.shape)
+      convsfmat = 10*np.ones((refl.shape),dtype=int)
+
+    #Compute zDiff, the variable representing the excess over the background dBZ
+    #an echo must achieve to be considered a convective core. (It has the dtype of background.)
+    #Only echo of at least weakechothres can be a core (the rest is set to 0 below), so zDiff is
+    #only computed there, which is also where convsf computes the background with echothres.
+    if np.ma.isMA(refl):
+      #Comparisons with a masked refl act on the data of its masked gates, so are done everywhere.
+      zDiff = 2.5 + minZdiff * np.cos((np.pi)*background/(2*deepcoszero))
+      zDiff[(background < 0)] = minZdiff
+
+      #If reflectivity exceeds background dBZ by zDiff, then echo is convective core.
+      isCore[(refl-background >= zDiff)] = CS_CORE;
+    else:
+      echo = refl >= weakechothres
+      bgecho = background[echo]
+      zDiff = 2.5 + minZdiff * np.cos((np.pi)*bgecho/(2*deepcoszero))
+      zDiff[(bgecho < 0)] = minZdiff
 
-  #If reflectivity exceeds background dBZ by zDiff, then echo is convective core.
-  isCore[(refl-background >= zDiff)] = CS_CORE;
+      #If reflectivity exceeds background dBZ by zDiff, then echo is convective core.
+      coreecho = isCore[echo]
+      coreecho[(refl[echo]-bgecho >= zDiff)] = CS_CORE
+      isCore[echo] = coreecho
+      del(echo,bgecho,coreecho)
+    del zDiff
 
-  #No chance of weak echoes being convective cores.
-  isCore[(refl < weakechothres)] = 0
+    #No chance of weak echoes being convective cores.
+    isCore[(refl < weakechothres)] = 0
 
   #Run the shallow, isolated convective core algorithm to detect small echoes that were
-  #often identified as STRATIFORM by Steiner et al. (1995)
-  (convsfmat,isCore) = rt.makedBZcluster(refl,isCore,convsfmat,weakechothres,minsize,maxsize,startslope,shallowconvmin,truncZconvthres,ISO_CONV_FRINGE,WEAK_ECHO,ISO_CS_CORE,CS_CORE,sectorarea,numTimes)
-
-  #Make initial guesses of classifications. There may be some redundancy in this code,
-  #later, but these operations are fast, I think. Better safe than sorry.
-  convsfmat[(isCore == CS_CORE)] = CONVECTIVE
-  convsfmat[(isCore == ISO_CS_CORE)] = ISO_CONV_CORE
-  convsfmat[(isCore == 0)] = WEAK_ECHO
-  convsfmat[(convsfmat == 10)] = STRATIFORM
-  convsfmat[(np.isnan(refl) == True)] = NO_ECHO
-  convsfmat[(refl < weakechothres)] = WEAK_ECHO
-  convsfmat[(refl < mindbzuse)] = NO_ECHO
-
-  #Now assign MIXED radius to each core. Currently assumes all echoes within 
-  #maxConvRadius - 4 km are MIXED classification. Stronger echoes have larger 
-  #mixed radius. Mixed radii of 6-10 km appear to be supported by algorithm 
-  #testing on WRF output as seen in Powell et al. (2016). 
-
-  #Compute what the mixed radius is as a function of echo intensity.
-  convRadiuskm = np.empty(refl.shape)
-  convRadiuskm[:] = np.nan
-  convRadiuskm[(background <= dBZformaxconvradius - 15 )] = maxConvRadius - 4
-  convRadiuskm[(background > dBZformaxconvradius - 15 )] = maxConvRadius - 3 
-  convRadiuskm[(background > dBZformaxconvradius - 10 )] = maxConvRadius - 2
-  convRadiuskm[(background > dBZformaxconvradius - 5 )] = maxConvRadius - 1
-  convRadiuskm[(background >= dBZformaxconvradius)] = maxConvRadius
-
-  ##Assign MIXED classification to pixels near convective cores.
+  #often identified as STRATIFORM by Steiner et al. (1995). The echo objects are labelled
+  #first (unless they were given), so that labelling is timed and counted on its own.
+  if labels is None:
+    with prof.stage(timings,'label'):
+      labels = rt.echolabels(refl,weakechothres,sectorarea,numTimes)
+  prof.count(timings,'echoes',labels[1])
+  with prof.stage(timings,'cluster'):
+    (convsfmat,isCore) = rt.makedBZcluster(refl,isCore,convsfmat,weakechothres,minsize,maxsize,startslope,shallowconvmin,truncZconvthres,ISO_CONV_FRINGE,WEAK_ECHO,ISO_CS_CORE,CS_CORE,sectorarea,numTimes,labels,kernels)
+
+  with prof.stage(timings,'mixed'):
+    #Make initial guesses of classifications. There may be some redundancy in this code,
+    #later, but these operations are fast, I think. Better safe than sorry.
+    convsfmat[(isCore == CS_CORE)] = CONVECTIVE
+    convsfmat[(isCore == ISO_CS_CORE)] = ISO_CONV_CORE
+    convsfmat[(isCore == 0)] = WEAK_ECHO
+    convsfmat[(convsfmat == 10)] = STRATIFORM
+    convsfmat[(np.isnan(refl) == True)] = NO_ECHO
+    convsfmat[(refl < weakechothres)] = WEAK_ECHO
+    convsfmat[(refl < mindbzuse)] = NO_ECHO
+
+    #Now assign MIXED radius to each core. Currently assumes all echoes within 
+    #maxConvRadius - 4 km are MIXED classification. Stronger echoes have larger 
+    #mixed radius. Mixed radii of 6-10 km appear to be supported by algorithm 
+    #testing on WRF output as seen in Powell et al. (2016). 
+
+    ##Assign MIXED classification to pixels near convective cores.
   
-  #If data is too close to the edge throw it out. 
-  isCore[maxR:numRanges,:] = 0      
- 
-  #Find 2D indices of convective cores.
-  (I,J) = np.where(isCore==CS_CORE)
-
-  if len(I) > 0:  #This "if" allows code to run even if there are no convective cores.
-
-    #Find 1D indices of convective cores.
-    indexhold = np.ravel_multi_index((I,J),convsfmat.shape,order="F")
-
-    #Add indices from mask (convcell) to indexhold.
-
-    #Accrue all of the masks in a list.
-    fulllist = convcell[I,np.int16(maxConvRadius-convRadiuskm[I,J])]
-
-    #Convert the list of lists to an array.
-    listarray = 9e16*np.ones([len(fulllist),len(max(fulllist,key=lambda x: len(x)))]) #9e16 is a missing value.
-    for i,j in enumerate(fulllist):
-      listarray[i][0:len(j)] = j
-    maskind = indexhold[:,None] + listarray
-
-    #Wrap data near 0 or 359 degrees around for continuity.
-    maskind[maskind < 0] = convsfmat.size + maskind[maskind < 0]
-    maskind[maskind > convsfmat.size-1] = maskind[maskind > convsfmat.size-1] - convsfmat.size
- 
-    #Restore large values to missing value.
-    maskind[maskind>9e9] = 9e16
-  
-    #Get 2D index values of points that could be mixed.
-    (K,L) = np.unravel_index(np.unique(maskind)[:-1].astype('int64'),convsfmat.shape,order='F') #-1 to exclude missing value.
-
-    #Save indices for points that were previously CONVECTIVE or ISOLATED CONVECTIVE.
-    (K1,L1) = np.where(convsfmat == CONVECTIVE)
-    (K2,L2) = np.where(convsfmat == ISO_CONV_CORE)
-    (K3,L3) = np.where(convsfmat == ISO_CONV_FRINGE)
- 
-    #Make masked point MIXED.
-    convsfmat[K,L] = MIXED  
+    #If data is too close to the edge throw it out. 
+    isCore[maxR:numRanges,:] = 0      
  
-    #Lots of data is made MIXED. Return the cores that aren't mixed back to 
-    #their previous classifications.
-    convsfmat[K1,L1] = CONVECTIVE
-    convsfmat[K2,L2] = ISO_CONV_CORE
-    convsfmat[K3,L3] = ISO_CONV_FRINGE
-    del(maskind,indexhold,listarray)
-
-  #Make sure original convective cores are CONVECTIVE.
-  convsfmat[isCore == CS_CORE] = CONVECTIVE
-
-  #If there is no data, or reflectivity is very low, classify as NO ECHO.
-  convsfmat[np.isnan(refl)==1] = NO_ECHO
-  convsfmat[refl < mindbzuse] = NO_ECHO
+    #Find 2D indices of convective cores.
+    (I,J) = np.where(isCore==CS_CORE)
+    prof.count(timings,'cores',len(I))
+
+    if len(I) > 0:  #This "if" allows code to run even if there are no convective cores.
+
+      #Find 1D indices of convective cores.
+      indexhold = np.ravel_multi_index((I,J),convsfmat.shape,order="F")
+
+      #Compute what the mixed radius is as a function of echo intensity. It is only needed at the
+      #cores, so it is only computed there.
+      bgcore = background[I,J]
+      convRadiuskm = np.empty(len(I),dtype=background.dtype)
+      convRadiuskm[:] = np.nan
+      convRadiuskm[(bgcore <= dBZformaxconvradius - 15 )] = maxConvRadius - 4
+      convRadiuskm[(bgcore > dBZformaxconvradius - 15 )] = maxConvRadius - 3 
+      convRadiuskm[(bgcore > dBZformaxconvradius - 10 )] = maxConvRadius - 2
+      convRadiuskm[(bgcore > dBZformaxconvradius - 5 )] = maxConvRadius - 1
+      convRadiuskm[(bgcore >= dBZformaxconvradius)] = maxConvRadius
+
+      #Mixed radius of each core, as an index into convcell.
+      maskradius = np.int16(maxConvRadius-convRadiuskm)
+
+      #Mark every point within the mask (convcell) of a core on a boolean grid.
+      ismixed = kernels.mixed(indexhold,I,maskradius,convcell,convsfmat.shape)
+
+      #The original code padded the masks of all the cores to the length of the longest with a
+      #missing value and dropped the largest index marked, meaning to drop that value. When every
+      #core's mask is the same length (e.g. a single core) there is no padding and a real point was
+      #dropped instead. This is kept so the output is that of Powell et al. (2016).
+      rings = np.unique(I*convcell.shape[1]+maskradius)
+      lengths = [len(convcell[k//convcell.shape[1],k%convcell.shape[1]]) for k in rings]
+      if min(lengths) == max(lengths):
+        last = np.flatnonzero(ismixed.T)[-1]
+        ismixed[np.unravel_index(last,convsfmat.shape,order="F")] = False
+
+      #Make masked point MIXED. Lots of data is made MIXED, so points that were previously
+      #CONVECTIVE or ISOLATED CONVECTIVE keep their previous classifications.
+      keep = (convsfmat == CONVECTIVE) | (convsfmat == ISO_CONV_CORE) | (convsfmat == ISO_CONV_FRINGE)
+      convsfmat[ismixed & ~keep] = MIXED
+      del(ismixed,keep,indexhold,bgcore,convRadiuskm)
+
+    #Make sure original convective cores are CONVECTIVE.
+    convsfmat[isCore == CS_CORE] = CONVECTIVE
+
+    #If there is no data, or reflectivity is very low, classify as NO ECHO.
+    convsfmat[np.isnan(refl)==1] = NO_ECHO
+    convsfmat[refl < mindbzuse] = NO_ECHO
   
-  #Classify WEAK_ECHO
-  convsfmat[refl < weakechothres] = WEAK_ECHO
+    #Classify WEAK_ECHO
+    convsfmat[refl < weakechothres] = WEAK_ECHO
 
-  #Any classifications on outer ring of data beyond maxR will be considered "missing".
-  convsfmat[maxR:numRanges,:] = rtfill
+    #Any classifications on outer ring of data beyond maxR will be considered "missing".
+    convsfmat[maxR:numRanges,:] = rtfill
 
-  #Format the output as integers.
-  convsfmat.astype(int)
+    #Format the output as integers.
+    convsfmat.astype(int)
 
   return convsfmat
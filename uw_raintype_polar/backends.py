@@ -0,0 +1,250 @@
+"""
+ ****Rain-type Classification code of Powell et al. (2016, JTECH): Compute backends*****#
+#Description: The three kernels most of the classification time goes into, for each backend
+#   that can run them:
+#
+#     background  mean background Z of every gate (algorithm.convsf)
+#     cluster     applying the values of each echo object to its points (rtfunctions.makedBZcluster)
+#     mixed       marking the points within the MIXED mask of every convective core
+#                 (algorithm.convectivecore)
+#
+#   'reference' is the NumPy code in rtfunctions.py. 'numba' compiles the same kernels with Numba,
+#   run in parallel over range rings and azimuths (background), rings (cluster) and cores (mixed); it
+#   is only there if Numba is installed. Its background is the mean of the same gates as the
+#   reference one, summed in a different order, so it agrees with it to floating-point tolerance,
+#   as bgengine = 'prefixsum' does; cluster and mixed give exactly the same result. The backend
+#   is chosen by name with the backend parameter (see runraintype.py), and 'auto' is 'numba' if it
+#   is there and 'reference' otherwise. Asking for a backend that couldn't be loaded falls back to
+#   'reference' with a warning.
+#
+#   Other backends can be added with register, and are then chosen by name like these:
+#
+#   >> backends.register('mine',background,cluster,mixed)
+#   >> rtc = classifier.RainTypeClassifier(backend='mine')
+#
+#   where the kernels take the same arguments as referencebackground, rt.applyobjects and
+#   rt.mixedmask.
+"""
+from __future__ import division   #For python2 users only.
+import warnings
+import numpy as np
+import rtfunctions as rt
+
+try:
+  import numba
+  prange = numba.prange
+except ImportError:
+  numba = None
+  prange = range
+
+
+class Backend(object):
+
+    #Purpose: To hold the kernels of one backend (see the description above).
+
+    def __init__(self,name,background,cluster,mixed):
+        self.name = name
+        self.background = background
+        self.cluster = cluster
+        self.mixed = mixed
+
+    def __repr__(self):
+        return 'Backend(' + repr(self.name) + ')'
+
+
+_registry = {}
+#Backends that couldn't be loaded, and why.
+_unavailable = {}
+_warned = set()
+
+
+def register(name,background,cluster,mixed):
+
+    #Purpose: To add a backend (or replace one) under name. Returns it.
+
+    backend = Backend(name,background,cluster,mixed)
+    _registry[name] = backend
+    _unavailable.pop(name,None)
+    return backend
+
+
+def available():
+
+    #Purpose: To list the names of the backends that can be used.
+
+    return sorted(_registry.keys())
+
+
+def get(name='reference'):
+
+    #Purpose: To return the backend called name ('auto' for the fastest one there is). A Backend is
+    #returned as it is.
+
+    if isinstance(name,Backend):
+      return name
+    if name is None:
+      name = 'reference'
+    if name == 'auto':
+      name = 'numba' if 'numba' in _registry else 'reference'
+    if name in _registry:
+      return _registry[name]
+    if name in _unavailable:
+      if name not in _warned:
+        warnings.warn('The ' + str(name) + ' backend is not available (' + _unavailable[name] + '). Using the reference backend.')
+        _warned.add(name)
+      return _registry['reference']
+    raise ValueError('Unknown backend ' + str(name) + '. Use ' + ', '.join(available() + sorted(_unavailable.keys())) + ' or auto.')
+
+
+#**********************End get********************
+
+
+def referencebackground(Zsweep,valid,maskcell,minR,maxR,numRanges,numTimes,dtype,bgengine,needed=None):
+
+    #Purpose: To compute the background with rt.backgroundgather or rt.backgroundprefixsum, as
+    #bgengine says. The arguments and the (background,count) returned are as for those.
+
+    if bgengine == 'gather':
+      return rt.backgroundgather(Zsweep,valid,maskcell,minR,maxR,numRanges,numTimes,dtype,needed)
+    elif bgengine == 'prefixsum':
+      return rt.backgroundprefixsum(Zsweep,valid,maskcell,minR,maxR,numRanges,numTimes,dtype,needed)
+    else:
+      raise ValueError('Unknown background engine ' + str(bgengine) + '. Use gather or prefixsum.')
+
+
+register('reference',referencebackground,rt.applyobjects,rt.mixedmask)
+
+
+#**********************End reference backend********************
+
+
+#The compiled kernels take the masks as one array of indices and the [start,stop) position of each
+#mask in it (as in the mask cache, see rt.savemasks). These are made once for each maskcell and
+#convcell and kept with them.
+_flat = {}
+
+def flatmasks(cell):
+
+    #Purpose: To return (idx,ptr) for maskcell (ptr is numRanges x 2) or convcell (numRanges x 5 x 2).
+    #Rings without masks have ptr -1.
+
+    key = id(cell)
+    if key in _flat and _flat[key][0] is cell:
+      return _flat[key][1]
+    (numRanges,numcols) = cell.shape
+    ptr = -np.ones([numRanges,numcols,2],dtype=np.int64)
+    chunks = []
+    n = 0
+    for R in range(0,numRanges):
+      for k in range(0,numcols):
+        mask = cell[R,k]
+        if mask is None:
+          continue
+        ptr[R,k,:] = [n,n+len(mask)]
+        n = n + len(mask)
+        chunks.append(np.asarray(mask,dtype=np.int64))
+    idx = np.concatenate(chunks) if len(chunks) > 0 else np.zeros(0,dtype=np.int64)
+    if numcols == 1:
+      ptr = ptr[:,0,:]
+    #Only the masks of the last few geometries are kept.
+    if len(_flat) >= 8:
+      _flat.clear()
+    _flat[key] = (cell,(idx,ptr))
+    return (idx,ptr)
+
+
+def _gatherkernel(Zsweep,valid,usevalid,needed,useneeded,idx,ptr,minR,maxR,numRanges,numTimes,halfnumTimes,background,count):
+    #Mean of Zsweep (1D, Fortran order) over the background mask of every gate of rings minR to maxR
+    #(those where needed is True, with useneeded), as rt.backgroundgather. The (ring,azimuth) pairs
+    #are spread over the threads ring by ring, so each thread gets masks of about the same size.
+    size = numRanges*numTimes
+    for n in prange((maxR-minR+1)*numTimes):
+      R = minR + n//numTimes
+      t = n % numTimes
+      if useneeded and not needed[R,t]:
+        continue
+      a = ptr[R,0]
+      b = ptr[R,1]
+      #As in rt.backgroundgather, the mask offsets are for the sweep wrapped half a sweep either side.
+      offset = R + numRanges*(2*halfnumTimes+t)
+      total = 0.0
+      c = 0
+      for k in range(a,b):
+        f = (idx[k]+offset) % size
+        total += Zsweep[f]
+        if usevalid:
+          c += valid[f]
+      if b > a:
+        background[t,R] = total/(b-a)
+      if usevalid:
+        count[t,R] = c
+
+
+def _clusterkernel(refl,isCore,convsfmat,echoes,isfringe,isweak,objecttrunc,truncZconvthres,ISO_CONV_FRINGE,WEAK_ECHO,ISO_CS_CORE,CS_CORE):
+    #rt.applyobjects in one pass over the points, one ring per thread.
+    (numRanges,numTimes) = refl.shape
+    for i in prange(numRanges):
+      for j in range(numTimes):
+        e = echoes[i,j]
+        if isfringe[e]:
+          convsfmat[i,j] = ISO_CONV_FRINGE
+        if isweak[e]:
+          isCore[i,j] = 0
+          convsfmat[i,j] = WEAK_ECHO
+        if refl[i,j] >= objecttrunc[e]:
+          isCore[i,j] = ISO_CS_CORE
+        if refl[i,j] >= truncZconvthres and convsfmat[i,j] != ISO_CONV_FRINGE:
+          isCore[i,j] = CS_CORE
+
+
+def _mixedkernel(indexhold,I,maskradius,idx,ptr,ismixed):
+    #rt.mixedmask, one core per thread. Threads whose masks overlap all write True to the same points.
+    size = ismixed.shape[0]
+    for n in prange(indexhold.shape[0]):
+      a = ptr[I[n],maskradius[n],0]
+      b = ptr[I[n],maskradius[n],1]
+      for k in range(a,b):
+        ismixed[(indexhold[n]+idx[k]) % size] = True
+
+
+def kernelbackend(name,gatherkernel,clusterkernel,mixedkernel):
+
+    #Purpose: To register a backend called name made of the kernels above (compiled or not): the
+    #arrays are put in the form they take and bgengine = 'prefixsum' is left to the reference backend.
+
+    def background(Zsweep,valid,maskcell,minR,maxR,numRanges,numTimes,dtype,bgengine,needed=None):
+      if bgengine != 'gather':
+        return referencebackground(Zsweep,valid,maskcell,minR,maxR,numRanges,numTimes,dtype,bgengine,needed)
+      (idx,ptr) = flatmasks(maskcell)
+      background = np.empty([numTimes,numRanges],dtype=dtype)
+      background[:] = np.nan
+      usevalid = valid is not None
+      count = np.zeros([numTimes,numRanges] if usevalid else [1,1],dtype=np.int32)
+      valid = np.ravel(valid,order="F") if usevalid else np.zeros(1,dtype=bool)
+      useneeded = needed is not None
+      needed = np.asarray(needed,dtype=bool) if useneeded else np.zeros([1,1],dtype=bool)
+      gatherkernel(np.ravel(Zsweep,order="F"),valid,usevalid,needed,useneeded,idx,ptr,minR,maxR,numRanges,numTimes,int(np.ceil(0.5*numTimes)),background,count)
+      return (background,count if usevalid else None)
+
+    def cluster(refl,isCore,convsfmat,echoes,isfringe,isweak,objecttrunc,truncZconvthres,ISO_CONV_FRINGE,WEAK_ECHO,ISO_CS_CORE,CS_CORE):
+      #The comparisons with a masked refl in rt.applyobjects are on its data, masked or not.
+      clusterkernel(np.asarray(refl),isCore,convsfmat,echoes,isfringe,isweak,objecttrunc,truncZconvthres,ISO_CONV_FRINGE,WEAK_ECHO,ISO_CS_CORE,CS_CORE)
+
+    def mixed(indexhold,I,maskradius,convcell,shape):
+      (idx,ptr) = flatmasks(convcell)
+      ismixed = np.zeros(int(np.prod(shape)),dtype=bool)
+      mixedkernel(np.asarray(indexhold,dtype=np.int64),np.asarray(I,dtype=np.int64),np.asarray(maskradius,dtype=np.int64),idx,ptr,ismixed)
+      return np.reshape(ismixed,shape,order="F")
+
+    return register(name,background,cluster,mixed)
+
+
+if numba is not None:
+  #Compiled the first time they are called (and cached on disk for later runs).
+  kernelbackend('numba',numba.njit(parallel=True,cache=True)(_gatherkernel),numba.njit(parallel=True,cache=True)(_clusterkernel),
+    numba.njit(parallel=True,cache=True)(_mixedkernel))
+else:
+  _unavailable['numba'] = 'Numba is not installed'
+
+
+#**********************End numba backend********************
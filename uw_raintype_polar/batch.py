@@ -0,0 +1,543 @@
+"""
+ ****Rain-type Classification code of Powell et al. (2016, JTECH): Batch processing*****#
+#Description: Functions for classifying a batch of CfRadial files, either one at a time or
+#   spread over several worker processes. The user-input parameters are passed around as a
+#   dictionary (params) whose keys are the variable names used in runraintype.py.
+#
+#   The background and MIXED masks (and sectorarea) are computed once for each radar geometry
+#   in the batch by the parent process and saved to the mask cache directory. Workers load them
+#   from there memory-mapped, so every worker shares one read-only copy of the masks instead of
+#   having them built or pickled for each file.
+"""
+from __future__ import division   #For python2 users only.
+import multiprocessing as mp
+import os
+import shutil
+import tempfile
+import threading
+import traceback
+import algorithm as alg
+import campaign
+import cfrad_io as io
+import classifier
+import manifest
+import profiler as prof
+import rtfunctions as rt
+import stats
+try:
+  import queue
+except ImportError:
+  import Queue as queue   #For python2 users only.
+
+#Masks already loaded in this process, keyed by rt.maskcachekey.
+_masks = {}
+_params = None
+_profiler = None
+#netCDF and HDF5 calls aren't thread safe, so the threads of a pipeline (see runpipeline) take turns
+#making them.
+_nclock = threading.RLock()
+#How the raintype field is stored (see runraintype.py) when params doesn't say, for both the
+#output files and the campaign store.
+STORAGE = dict(rtdtype='int32',complevel=0,shuffle=False,chunkrays=None)
+
+
+def storage(params):
+
+    #Purpose: To return the raintype storage options in params, with STORAGE for any not given.
+
+    return dict((k,params.get(k,v)) for (k,v) in STORAGE.items())
+
+
+def readfile(fname,params):
+
+    #Purpose: To read the chosen sweep of a file. Returns a dictionary (volume) with the sweep,
+    #its geometry and everything from readcfrad needed to write the output. The file stays open
+    #(volume['ncid']) until writefile is done with it.
+
+    p = params
+    volume = {'fname':fname}
+
+    #Read in CF/Radial file
+    (volume['sls_size'],volume['sweep_number1'],volume['volume_number1'],volume['time_coverage_start1'],volume['time_coverage_end1'],volume['starttime'],volume['lat1'],volume['lon1'],volume['alt1'],volume['sweep_mode1'],volume['fixed_angle1'],volume['time1'],volume['range1'],volume['azimuth1'],volume['elevation1'],volume['ssri1'],volume['seri1'],volume['meterstoFirstGate'],volume['metersBetweenGates'],volume['kmToFirstGate'],volume['kmBetweenGates'],volume['sweep_start_ray_index'],volume['sweep_end_ray_index'],volume['ins_name'],volume['ncid']) = io.readcfrad(fname,p['sweep_used'],p['reflName'],p['ldrName'],p['clutterName'])
+
+    try:
+      #Read designated sweeps. Each entry of volume['sweeps'] holds the sweep index, reflectivity
+      #and dimensions of one sweep.
+      volume['sweep_used'] = io.selectsweeps(volume['ncid'],p['sweep_used'])
+      volume['sweeps'] = []
+      for sweep_used in volume['sweep_used']:
+        #With params['packedrefl'] = 1, packed reflectivity is converted by lookup (see cfrad_io.readsweep).
+        if p.get('packedrefl',0) == 1:
+          (dBZsweep,numRanges,numTimes,packed) = io.readsweep(volume['ncid'],volume['sweep_start_ray_index'],volume['sweep_end_ray_index'],sweep_used,volume['fixed_angle1'],p['reflName'],p['ldrName'],p['clutterName'],True)
+        else:
+          (dBZsweep,numRanges,numTimes) = io.readsweep(volume['ncid'],volume['sweep_start_ray_index'],volume['sweep_end_ray_index'],sweep_used,volume['fixed_angle1'],p['reflName'],p['ldrName'],p['clutterName'])
+          packed = None
+        volume['sweeps'].append({'sweep_used':sweep_used,'dBZsweep':dBZsweep,'numRanges':numRanges,'numTimes':numTimes,'packed':packed})
+    except:
+      volume['ncid'].close()
+      raise
+
+    return volume
+
+
+def classifyvolume(volume,params,masks=None,timings=None):
+
+    #Purpose: To run the algorithm on each sweep of a volume from readfile. Returns a list with
+    #the rain-type array of each sweep. masks is an optional dictionary of
+    #(maskcell,convcell,sectorarea,minR,maxR) keyed by rt.maskcachekey. Masks are taken from it if
+    #present and added to it if not. If timings is a dictionary, the time spent in the 'background',
+    #'cluster' and 'mixed' stages is added to it.
+
+    #Sweeps with the same geometry share masks, even if masks aren't kept between volumes.
+    rtc = classifier.RainTypeClassifier(params,masks)
+    geometry = (volume['kmToFirstGate'],volume['kmBetweenGates'])
+
+    raintypes = []
+    for sweep in volume['sweeps']:
+      #The sweeps were read for this volume only, so they needn't be copied.
+      raintypes.append(rtc.classify(sweep['dBZsweep'],geometry,timings,copy=False,packed=sweep.get('packed')))
+
+    return raintypes
+
+
+def writefile(volume,raintypes,params):
+
+    #Purpose: To write the rain type of each sweep of a volume (raintypes, from classifyvolume) to a
+    #new CF/Radial file and close the input file.
+    #The output is written under a temporary name and renamed when complete, so anything watching
+    #the output directory never sees a partly written file. With params['appendsource'] = 1 the rain
+    #type is instead added to the input file itself (see cfrad_io.appendcfrad), and if
+    #params['campaignfile'] is set it is appended to that campaign store (see campaign.py). Returns
+    #the name of the output file.
+
+    p = params
+    v = volume
+    sdir = os.path.basename(v['fname'])
+    outname = p['fileDirOut']+'raintype.'+sdir
+    options = storage(p)
+
+    if p.get('campaignfile') is not None:
+      try:
+        appendcampaign(campaign.volumerecords(v,raintypes),params)
+      finally:
+        v['ncid'].close()
+      return p['campaignfile']
+
+    if p.get('appendsource',0) == 1:
+      #The input file has to be closed before it can be opened for writing.
+      v['ncid'].close()
+      io.appendcfrad(v['fname'],raintypes,v['sweep_used'],p['rtfill'],**options)
+      return v['fname']
+
+    try:
+      #Write the data to a new CF/Radial file that is viewable in CIDD.
+      io.writecfrad(p['fileDirOut'],sdir+'.part',raintypes,v['sls_size'],v['volume_number1'],v['time_coverage_start1'],v['time_coverage_end1'],v['lat1'],v['lon1'],v['alt1'],v['sweep_number1'],v['sweep_mode1'],v['sweep_used'],v['fixed_angle1'],v['ssri1'],v['seri1'],v['time1'],v['range1'],v['meterstoFirstGate'],v['metersBetweenGates'],v['azimuth1'],v['elevation1'],p['rtfill'],v['starttime'],v['ins_name'],p['title'],p['institution'],p['source'],p['references'],coordprecision=p.get('coordprecision','double'),**options)
+      os.rename(outname+'.part',outname)
+    finally:
+      v['ncid'].close()
+
+    return outname
+
+
+def processfile(fname,params,masks=None,timings=None):
+
+    #Purpose: To classify one file and write the result. Returns the name of the output file.
+    #masks is as in classifyvolume. If timings is a dictionary (or a profiler.Profiler), the time
+    #spent reading, in each stage of the algorithm and writing is added to it.
+
+    with prof.stage(timings,'read'):
+      volume = readfile(fname,params)
+    try:
+      raintypes = classifyvolume(volume,params,masks,timings)
+    except:
+      volume['ncid'].close()
+      raise
+    with prof.stage(timings,'write'):
+      outname = writefile(volume,raintypes,params)
+
+    return outname
+
+
+#**********************End processfile********************
+
+
+def appendcampaign(records,params):
+
+    #Purpose: To append campaign-store records (from campaign.volumerecords) to params['campaignfile'],
+    #with the raintype storage options and attributes in params.
+
+    p = params
+    options = storage(p)
+    with _nclock:
+      campaign.appendrecords(p['campaignfile'],records,p['rtfill'],p['title'],p['institution'],p['source'],p['references'],options['rtdtype'],options['complevel'],options['shuffle'])
+
+
+#**********************End appendcampaign********************
+
+
+def newstats(params):
+
+    #Purpose: To make an empty stats.RainTypeStats for the classes in params.
+
+    p = params
+    return stats.RainTypeStats(max(p['NO_ECHO'],p['STRATIFORM'],p['CONVECTIVE'],p['MIXED'],p['ISO_CONV_CORE'],p['ISO_CONV_FRINGE'],p['WEAK_ECHO'])+1,p.get('statsringkm',1.0),p['CONVECTIVE'],p['MIXED'])
+
+
+def reducefile(fname,params,masks=None,timings=None):
+
+    #Purpose: To classify one file and return the statistics of its sweeps (a stats.RainTypeStats)
+    #without writing anything. masks and timings are as in processfile.
+
+    p = params
+    if masks is None:
+      masks = {}
+    with prof.stage(timings,'read'):
+      volume = readfile(fname,p)
+    try:
+      raintypes = classifyvolume(volume,p,masks,timings)
+      records = campaign.volumerecords(volume,raintypes)
+    finally:
+      volume['ncid'].close()
+
+    return volumestats(volume,records,p,masks)
+
+
+def volumestats(volume,records,params,masks):
+
+    #Purpose: To return the statistics (a stats.RainTypeStats) of the campaign records of a volume.
+    #masks is the dictionary the volume was classified with, which has the sectorarea of its sweeps.
+
+    p = params
+    s = newstats(p)
+    for r in records:
+      key = rt.maskcachekey(r['numRanges'],r['numTimes'],volume['kmToFirstGate'],volume['kmBetweenGates'],p['backgrndradius'],p['maxConvRadius'])
+      s.update(r['raintype'],masks[key][2],volume['kmToFirstGate'],volume['kmBetweenGates'],r['time'],r['source_file']+':'+str(r['sweep_index']))
+
+    return s
+
+
+#**********************End reducefile********************
+
+
+def newprofiler(params):
+
+    #Purpose: To make the profiler.Profiler that logs to params['profilelog'] (with the peak memory
+    #of each stage if params['profilememory'] is True), or None if there is no profile log.
+
+    p = params
+    if p.get('profilelog') is None:
+      return None
+    return prof.Profiler([prof.jsonlinessink(p['profilelog'])],p.get('profilememory',False))
+
+
+#**********************End newprofiler********************
+
+
+def precomputemasks(fnames,params):
+
+    #Purpose: To build the masks for every geometry in a batch ahead of time and save them to
+    #params['maskcacheDir']. Files whose geometry can't be read are left for processfile to
+    #report. Returns the set of keys of the geometries found.
+
+    p = params
+    keys = set()
+    for fname in fnames:
+      try:
+        geometry = io.readgeometry(fname,p['sweep_used'])
+      except Exception:
+        continue
+      for (numRanges,numTimes,kmToFirstGate,kmBetweenGates) in geometry:
+        key = rt.maskcachekey(numRanges,numTimes,kmToFirstGate,kmBetweenGates,p['backgrndradius'],p['maxConvRadius'])
+        if key not in keys:
+          alg.getmasks(kmToFirstGate,kmBetweenGates,numRanges,numTimes,p['backgrndradius'],p['maxConvRadius'],p['maskcacheDir'])
+          keys.add(key)
+
+    return keys
+
+
+#**********************End precomputemasks********************
+
+
+def _initworker(params):
+    global _params,_profiler
+    _params = params
+    _masks.clear()
+    _profiler = newprofiler(params)
+
+def _runone(fname):
+    #Runs in a worker. Failures are returned rather than raised so the rest of the batch goes on.
+    #When writing to a campaign store or collecting statistics, the store's records or the file's
+    #statistics are returned instead of an output file name, so that only the parent process writes.
+    try:
+      #With repeatmask = 1, masks aren't kept in memory between files (see runraintype.py).
+      if _params.get('repeatmask',0) == 0:
+        masks = _masks
+      else:
+        masks = None
+      if _params.get('statsfile') is not None:
+        result = (fname,reducefile(fname,_params,masks,_profiler),None)
+      elif _params.get('campaignfile') is None:
+        result = (fname,processfile(fname,_params,masks,_profiler),None)
+      else:
+        with prof.stage(_profiler,'read'):
+          volume = readfile(fname,_params)
+        try:
+          records = campaign.volumerecords(volume,classifyvolume(volume,_params,masks,_profiler))
+        finally:
+          volume['ncid'].close()
+        result = (fname,records,None)
+    except Exception:
+      result = (fname,None,traceback.format_exc())
+    if _profiler is not None:
+      _profiler.emit(file=fname,pid=os.getpid(),failed=result[2] is not None)
+    return result
+
+def _collect(result,params,total):
+    #Adds the statistics of a file to total, or appends its records to the campaign store, in the
+    #parent process.
+    (fname,output,error) = result
+    if error is not None:
+      return result
+    try:
+      if params.get('statsfile') is not None:
+        total.merge(output)
+        return (fname,params['statsfile'],None)
+      if params.get('campaignfile') is not None:
+        appendcampaign(output,params)
+        return (fname,params['campaignfile'],None)
+    except Exception:
+      return (fname,None,traceback.format_exc())
+    return result
+
+
+#**********************End _collect********************
+
+
+def _finishvolume(volume,raintypes,params,masks):
+    #Writes the rain types of a volume, or makes its campaign records or statistics, as _runone does,
+    #and closes its file.
+    p = params
+    if p.get('statsfile') is None and p.get('campaignfile') is None:
+      return writefile(volume,raintypes,p)
+    try:
+      records = campaign.volumerecords(volume,raintypes)
+    finally:
+      volume['ncid'].close()
+    if p.get('statsfile') is not None:
+      return volumestats(volume,records,p,masks)
+    return records
+
+
+def runpipeline(fnames,params,depth=2,masks=None,profiler=None,done=None):
+
+    #Purpose: To classify a list of files in this process with reading, classifying and writing
+    #overlapped. A reader thread reads the files ahead into a queue of up to depth volumes, this
+    #thread classifies them and a writer thread writes them (or makes their campaign records or
+    #statistics, as _runone does) from a second queue of up to depth volumes. The queues are bounded,
+    #so a slow stage holds up the ones before it, and at most 2*depth+3 volumes are in memory at
+    #once. The threads take turns with netCDF (_nclock). The classification overlaps with reading
+    #and writing as far as NumPy and netCDF4 release the interpreter lock.
+    #Returns a list of (input file, output, error) tuples in the order of fnames, as _runone
+    #returns. done, if given, is called (in the writer thread) with each as the file is done, and
+    #what it returns is kept instead. masks is as in processfile (None for new masks for every file).
+    #With profiler (a profiler.Profiler), each file is timed and counted by a Profiler of its own
+    #that is emitted to the same sinks once the file is written. Peak memory isn't recorded, since
+    #the stages of different files overlap.
+
+    p = params
+    readq = queue.Queue(max(1,depth))
+    writeq = queue.Queue(max(1,depth))
+    stop = threading.Event()
+    results = []
+    failure = []
+
+    def put(q,item):
+      #Waits for room in q. Returns False if the pipeline is stopped first.
+      while not stop.is_set():
+        try:
+          q.put(item,timeout=0.1)
+          return True
+        except queue.Full:
+          continue
+      return False
+
+    def get(q):
+      #Waits for the next item of q. Returns None if the pipeline is stopped first.
+      while not stop.is_set():
+        try:
+          return q.get(timeout=0.1)
+        except queue.Empty:
+          continue
+      return None
+
+    def close(volume):
+      if volume is not None:
+        with _nclock:
+          volume['ncid'].close()
+
+    def read():
+      for fname in fnames:
+        timings = None if profiler is None else prof.Profiler(profiler.sinks)
+        (volume,error) = (None,None)
+        try:
+          with prof.stage(timings,'read'):
+            with _nclock:
+              volume = readfile(fname,p)
+        except Exception:
+          error = traceback.format_exc()
+        if not put(readq,(fname,volume,timings,error)):
+          close(volume)
+          return
+      put(readq,None)
+
+    def write():
+      try:
+        while True:
+          item = get(writeq)
+          if item is None:
+            return
+          (fname,volume,raintypes,filemasks,timings,error) = item
+          output = None
+          if error is None:
+            try:
+              with prof.stage(timings,'write'):
+                with _nclock:
+                  output = _finishvolume(volume,raintypes,p,filemasks)
+            except Exception:
+              error = traceback.format_exc()
+          else:
+            close(volume)
+          result = (fname,output,error)
+          if timings is not None:
+            timings.emit(file=fname,pid=os.getpid(),failed=error is not None)
+          if done is not None:
+            result = done(result)
+          results.append(result)
+      except BaseException as e:
+        failure.append(e)
+        stop.set()
+
+    reader = threading.Thread(target=read)
+    writer = threading.Thread(target=write)
+    reader.daemon = True
+    writer.daemon = True
+    reader.start()
+    writer.start()
+    try:
+      while True:
+        item = get(readq)
+        if item is None:
+          break
+        (fname,volume,timings,error) = item
+        filemasks = masks if masks is not None else {}
+        raintypes = None
+        if error is None:
+          try:
+            raintypes = classifyvolume(volume,p,filemasks,timings)
+          except Exception:
+            error = traceback.format_exc()
+        if not put(writeq,(fname,volume,raintypes,filemasks,timings,error)):
+          close(volume)
+          break
+      put(writeq,None)
+      writer.join()
+    finally:
+      stop.set()
+      reader.join()
+      writer.join()
+      #Close the files of any volumes left in the queues if the pipeline was stopped early.
+      for q in (readq,writeq):
+        while not q.empty():
+          item = q.get()
+          if item is not None:
+            close(item[1])
+
+    if len(failure) > 0:
+      raise failure[0]
+    return results
+
+
+#**********************End runpipeline********************
+
+
+def runbatch(fnames,params,nworkers=1):
+
+    #Purpose: To classify a list of files with nworkers processes. Returns a list with one
+    #(input file, output file, error) tuple per input file, in the order of fnames. For files
+    #that were processed, error is None; for files that failed, output file is None and error
+    #is the traceback. With params['campaignfile'] set, every file is appended to that campaign
+    #store (by this process, in the order of fnames) and it is the output file. With
+    #params['statsfile'] set, nothing is written per file: the statistics of every file (see
+    #stats.py) are merged and saved to statsfile, which is the output file.
+    #With params['manifestfile'] set, files already done with the same parameters (see
+    #manifest.py) are skipped and returned with their earlier output file, and every file
+    #processed is recorded in the manifest as it finishes. Failures are also appended to
+    #params['failurelog'], if set. Statistics are only of the files processed in this run, so
+    #with statsfile no file is skipped.
+    #With params['profilelog'] set, the time spent in each stage, counts and (with
+    #params['profilememory'] = True) the peak memory of each stage for every file processed are
+    #appended to that file as JSON lines (see profiler.py).
+    #With nworkers = 1 and params['pipelinedepth'] > 0, files are read ahead and written behind
+    #the classification by threads (see runpipeline), with up to pipelinedepth volumes queued
+    #between each stage.
+
+    p = dict(params)
+
+    man = None
+    skipped = {}
+    todo = list(fnames)
+    if p.get('manifestfile') is not None:
+      man = manifest.Manifest(p['manifestfile'])
+      phash = manifest.paramhash(p)
+      if p.get('statsfile') is None:
+        for fname in fnames:
+          if man.isdone(fname,phash):
+            skipped[fname] = (fname,man.entries[os.path.abspath(fname)]['output'],None)
+        todo = [fname for fname in fnames if fname not in skipped]
+
+    def record(result):
+      if man is not None:
+        man.record(result[0],phash,result[1],result[2])
+        if result[2] is not None and p.get('failurelog') is not None:
+          manifest.logfailure(p['failurelog'],result[0],phash,result[2])
+      return result
+
+    #Without a mask cache directory, share the masks through a temporary one for this batch.
+    tmpcache = None
+    if p.get('maskcacheDir') is None:
+      tmpcache = tempfile.mkdtemp(prefix='raintype_masks_')
+      p['maskcacheDir'] = tmpcache
+
+    total = newstats(p)
+    try:
+      if nworkers <= 1 and p.get('pipelinedepth',0) > 0:
+        _initworker(p)
+        masks = _masks if p.get('repeatmask',0) == 0 else None
+        results = runpipeline(todo,p,p['pipelinedepth'],masks,_profiler,lambda result: record(_collect(result,p,total)))
+      elif nworkers <= 1:
+        _initworker(p)
+        results = [record(_collect(_runone(fname),p,total)) for fname in todo]
+      else:
+        precomputemasks(todo,p)
+        pool = mp.Pool(nworkers,initializer=_initworker,initargs=(p,))
+        try:
+          #Results come back in the order of fnames, so the campaign store is too.
+          results = [record(_collect(result,p,total)) for result in pool.imap(_runone,todo,chunksize=1)]
+        finally:
+          pool.close()
+          pool.join()
+    finally:
+      if nworkers <= 1 and _profiler is not None:
+        _profiler.close()
+      if tmpcache is not None:
+        shutil.rmtree(tmpcache,ignore_errors=True)
+
+    if p.get('statsfile') is not None:
+      total.save(p['statsfile'])
+    if len(skipped) > 0:
+      done = dict((result[0],result) for result in results)
+      results = [skipped[fname] if fname in skipped else done[fname] for fname in fnames]
+    return results
+
+
+#**********************End runbatch********************
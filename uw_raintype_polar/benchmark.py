@@ -0,0 +1,155 @@
+"""
+ ****Rain-type Classification code of Powell et al. (2016, JTECH): Benchmarks*****#
+#Description: Times each stage of the classification on synthetic CfRadial files (see
+#   synthetic.py) and records the wall time and peak memory of every stage to a JSON file,
+#   so that runs before and after a change can be compared.
+#
+#   Stages: readcfrad, readsweep, masks (mask setup in convsf, no cache), background (convsf
+#   with the masks already made), makedBZcluster, convectivecore (including makedBZcluster)
+#   and writecfrad.
+#
+#   >> python -W ignore benchmark.py                          #All cases, results to benchmark.json
+#   >> python -W ignore benchmark.py --cases base_2d clear    #Only some cases
+#   >> python -W ignore benchmark.py --output new.json --compare benchmark.json
+#
+#   Algorithm parameters are those in runraintype.py.
+"""
+from __future__ import division   #For python2 users only.
+import argparse
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import algorithm as alg
+import cfrad_io as io
+import rtfunctions as rt
+import runraintype
+import synthetic
+
+#Benchmark cases. Gate spacing and first gate are in km. numcells, shieldradius and numshields set the
+#echo coverage (see synthetic.makesweep), and ragged selects 1D (ray_start_index/ray_n_gates) storage.
+CASES = [
+  dict(name='base_2d',numRanges=400,numTimes=360,kmBetweenGates=0.15,kmToFirstGate=0.075,numcells=60,shieldradius=25,numshields=1,ragged=False),
+  dict(name='base_ragged',numRanges=400,numTimes=360,kmBetweenGates=0.15,kmToFirstGate=0.075,numcells=60,shieldradius=25,numshields=1,ragged=True),
+  dict(name='widespread',numRanges=400,numTimes=360,kmBetweenGates=0.15,kmToFirstGate=0.075,numcells=200,shieldradius=30,numshields=3,ragged=False),
+  dict(name='scattered',numRanges=400,numTimes=360,kmBetweenGates=0.15,kmToFirstGate=0.075,numcells=600,shieldradius=0,numshields=0,ragged=True),
+  dict(name='clear',numRanges=400,numTimes=360,kmBetweenGates=0.15,kmToFirstGate=0.075,numcells=0,shieldradius=0,numshields=0,ragged=False),
+  dict(name='fine_ragged',numRanges=1000,numTimes=720,kmBetweenGates=0.075,kmToFirstGate=0.0375,numcells=100,shieldradius=25,numshields=1,ragged=True),
+]
+
+
+def measure(fn,repeat):
+
+    #Purpose: To time fn() repeat times, then run it once more with tracemalloc to find its peak
+    #memory. Returns (best wall time, median wall time, peak bytes, output of fn). fn is run once
+    #first, untimed, so that imports and file caches don't count against the first run.
+
+    fn()
+    times = []
+    for i in range(0,repeat):
+      t0 = time.perf_counter()
+      output = fn()
+      times.append(time.perf_counter()-t0)
+    tracemalloc.start()
+    try:
+      fn()
+      peak = tracemalloc.get_traced_memory()[1]
+    finally:
+      tracemalloc.stop()
+
+    return (min(times),float(np.median(times)),peak,output)
+
+
+def runcase(case,params,workdir,repeat):
+
+    #Purpose: To write the synthetic file for a case and benchmark every stage on it. Returns a
+    #list of result dictionaries, one per stage.
+
+    p = params
+    c = case
+    sweep_used = 0
+    fname = os.path.join(workdir,c['name']+'.nc')
+    dBZ = synthetic.makesweep(c['numRanges'],c['numTimes'],c['kmBetweenGates'],c['kmToFirstGate'],0,c['numcells'],c['shieldradius'],c['numshields'])
+    synthetic.writesynthetic(fname,dBZ,c['kmBetweenGates'],c['kmToFirstGate'],p['reflName'],c['ragged'])
+
+    results = []
+    def record(stage,measured):
+      results.append(dict(case=c['name'],stage=stage,best_s=measured[0],median_s=measured[1],peak_bytes=measured[2]))
+      return measured[3]
+
+    def read():
+      output = io.readcfrad(fname,sweep_used,p['reflName'],p['ldrName'],p['clutterName'])
+      output[-1].close()
+      return output
+    record('readcfrad',measure(read,repeat))
+    meta = io.readcfrad(fname,sweep_used,p['reflName'],p['ldrName'],p['clutterName'])
+    ncid = meta[-1]
+    try:
+      (kmToFirstGate,kmBetweenGates,ssri,seri) = (meta[19],meta[20],meta[21],meta[22])
+      (dBZsweep,numRanges,numTimes) = record('readsweep',measure(lambda: io.readsweep(ncid,ssri,seri,sweep_used,meta[10],p['reflName'],p['ldrName'],p['clutterName']),repeat))
+
+      (maskcell,convcell,sectorarea,minR,maxR) = record('masks',measure(lambda: alg.getmasks(kmToFirstGate,kmBetweenGates,numRanges,numTimes,p['backgrndradius'],p['maxConvRadius']),repeat))
+      (background,refl,minR,maxR) = record('background',measure(lambda: alg.convsf(kmToFirstGate,kmBetweenGates,numRanges,numTimes,p['backgrndradius'],p['maxConvRadius'],sweep_used,dBZsweep.copy(),1,0,maskcell,None,p['bgengine']),repeat))
+
+      #makedBZcluster on its own, starting from no cores and an unclassified sweep.
+      record('makedBZcluster',measure(lambda: rt.makedBZcluster(refl,np.ones(refl.shape),10*np.ones(refl.shape,dtype=np.int64),p['weakechothres'],p['minsize'],p['maxsize'],p['startslope'],p['shallowconvmin'],p['truncZconvthres'],p['ISO_CONV_FRINGE'],p['WEAK_ECHO'],p['ISO_CS_CORE'],p['CS_CORE'],sectorarea,numTimes),repeat))
+
+      raintype = record('convectivecore',measure(lambda: alg.convectivecore(background,refl,p['minZdiff'],p['CS_CORE'],p['ISO_CS_CORE'],p['CONVECTIVE'],p['STRATIFORM'],p['MIXED'],p['WEAK_ECHO'],p['ISO_CONV_CORE'],p['ISO_CONV_FRINGE'],p['NO_ECHO'],p['dBZformaxconvradius'],p['maxConvRadius'],p['weakechothres'],p['deepcoszero'],p['minsize'],p['maxsize'],p['startslope'],p['shallowconvmin'],p['truncZconvthres'],p['mindbzuse'],sectorarea,convcell,maxR,numRanges,numTimes,p['rtfill']),repeat))
+
+      record('writecfrad',measure(lambda: io.writecfrad(workdir+os.sep,c['name']+'.nc',raintype,meta[0],meta[2],meta[3],meta[4],meta[6],meta[7],meta[8],meta[1],meta[9],sweep_used,meta[10],meta[15],meta[16],meta[11],meta[12],meta[17],meta[18],meta[13],meta[14],p['rtfill'],meta[5],meta[23],p['title'],p['institution'],p['source'],p['references']),repeat))
+    finally:
+      ncid.close()
+
+    for r in results:
+      r.update(dict((k,c[k]) for k in c if k != 'name'))
+    return results
+
+
+def compare(old,new):
+
+    #Purpose: To print the ratio of new to old best time and peak memory for every case and stage
+    #found in both sets of results.
+
+    before = dict(((r['case'],r['stage']),r) for r in old['results'])
+    print('%-14s %-15s %10s %10s %7s %8s' % ('case','stage','old (s)','new (s)','time','memory'))
+    for r in new['results']:
+      o = before.get((r['case'],r['stage']))
+      if o is None:
+        continue
+      print('%-14s %-15s %10.4f %10.4f %6.2fx %7.2fx' % (r['case'],r['stage'],o['best_s'],r['best_s'],r['best_s']/max(o['best_s'],1e-12),r['peak_bytes']/max(o['peak_bytes'],1)))
+
+
+#**********************End compare********************
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the rain-type classification stages on synthetic CfRadial files.')
+    parser.add_argument('--cases',nargs='*',default=None,help='names of the cases to run (default: all)')
+    parser.add_argument('--repeat',type=int,default=3,help='timed runs per stage (default: 3)')
+    parser.add_argument('--output',default='benchmark.json',help='file to save the results to')
+    parser.add_argument('--compare',default=None,help='earlier results file to compare against')
+    args = parser.parse_args()
+
+    cases = [c for c in CASES if args.cases is None or c['name'] in args.cases]
+    workdir = tempfile.mkdtemp(prefix='raintype_bench_')
+    results = []
+    try:
+      for case in cases:
+        results.extend(runcase(case,runraintype.params,workdir,args.repeat))
+        for r in results[-7:]:
+          print('%-14s %-15s %10.4f s %10.1f MB' % (r['case'],r['stage'],r['best_s'],r['peak_bytes']/1e6))
+    finally:
+      shutil.rmtree(workdir,ignore_errors=True)
+
+    output = dict(time=time.strftime('%Y-%m-%dT%H:%M:%S'),python=platform.python_version(),numpy=np.__version__,machine=platform.machine(),
+                  params=dict((k,v) for (k,v) in runraintype.params.items() if isinstance(v,(int,float,str))),repeat=args.repeat,results=results)
+    with open(args.output,'w') as f:
+      json.dump(output,f,indent=1)
+
+    if args.compare is not None:
+      with open(args.compare) as f:
+        compare(json.load(f),output)
@@ -0,0 +1,215 @@
+"""
+ ****Rain-type Classification code of Powell et al. (2016, JTECH): Campaign store*****#
+#Description: Functions for keeping the rain type of a whole campaign in one NetCDF4 file instead
+#   of one small file per volume. Each classified sweep is appended as a record along the unlimited
+#   'volume' dimension, with its start time, the file and sweep it came from, and an index into a
+#   table of the radar geometries seen so far. The whole campaign can then be opened once and
+#   sliced by time:
+#
+#   >> import campaign
+#   >> c = campaign.readcampaign('dynamo_raintype.nc','2011-10-01T00:00:00','2011-10-02T00:00:00')
+#   >> c['raintype'].shape     #(volumes x rays x gates)
+#
+#   Set campaignfile in runraintype.py to write to a campaign store. raintype is stored
+#   (volume x ray x gate) with the ray and gate dimensions unlimited too, so sweeps with more rays or
+#   gates than those already in the store can be added; smaller sweeps are padded with rtfill.
+"""
+from __future__ import division   #For python2 users only.
+import calendar
+import os
+import time
+import numpy as np
+import netCDF4 as nc4
+
+TIMEUNITS = 'seconds since 1970-01-01T00:00:00Z'
+
+
+def parsetime(text):
+
+    #Purpose: To turn an ISO 8601 time ('2011-10-01T00:00:00Z', the Z and anything after the seconds
+    #optional, or just the date '2011-10-01') into seconds since 1970. Returns NaN if text isn't
+    #such a time.
+
+    text = text.strip()
+    for (fmt,n) in (('%Y-%m-%dT%H:%M:%S',19),('%Y-%m-%d %H:%M:%S',19),('%Y-%m-%d',10)):
+      try:
+        return float(calendar.timegm(time.strptime(text[:n],fmt)))
+      except ValueError:
+        continue
+    return np.nan
+
+
+#**********************End parsetime********************
+
+
+def volumerecords(volume,raintypes):
+
+    #Purpose: To make the campaign-store records of a volume from batch.readfile and its rain types
+    #from batch.classifyvolume, one per sweep. The volume's file must still be open. Records only hold
+    #plain numbers and arrays, so they can be sent from worker processes to the one writing the store.
+
+    v = volume
+    #The start time comes from time_coverage_start, or failing that the units of time.
+    start = parsetime(str(nc4.chartostring(np.ma.getdata(v['time_coverage_start1'][:]))))
+    if np.isnan(start) and 'units' in v['time1'].ncattrs():
+      start = parsetime(v['time1'].units.replace('seconds since ',''))
+
+    records = []
+    for k in range(0,len(v['sweep_used'])):
+      sweep_used = v['sweep_used'][k]
+      first = int(v['sweep_start_ray_index'][sweep_used])
+      numTimes = raintypes[k].shape[1]
+      records.append({'time':start + float(v['time1'][first]),'source_file':os.path.basename(v['fname']),'sweep_index':sweep_used,
+        'fixed_angle':float(v['fixed_angle1'][sweep_used]),'numRanges':raintypes[k].shape[0],'numTimes':numTimes,
+        'meterstoFirstGate':float(v['meterstoFirstGate']),'metersBetweenGates':float(v['metersBetweenGates']),
+        'azimuth':np.asarray(v['azimuth1'][first:first+numTimes],dtype=np.float32),'raintype':raintypes[k]})
+
+    return records
+
+
+#**********************End volumerecords********************
+
+
+def createcampaign(fname,numRanges,numTimes,rtfill,title,institution,source,references,rtdtype='int8',complevel=4,shuffle=True):
+
+    #Purpose: To create an empty campaign store. raintype is chunked one sweep of numTimes rays and
+    #numRanges gates at a time, so reading any run of volumes only touches their own chunks.
+
+    import cfrad_io as io
+
+    ncid = nc4.Dataset(fname,'w',format='NETCDF4')
+    try:
+      ncid.title = title
+      ncid.source = source
+      ncid.institution = institution
+      ncid.references = references
+      ncid.comment = "NO ECHO = 0, STRATIFORM = 1, CONVECTIVE = 2, MIXED = 3, ISOLATED CONVECTIVE CORE = 4, ISOLATED CONVECTIVE FRINGE = 5, WEAK ECH0 = 6"
+
+      ncid.createDimension('volume',None)
+      ncid.createDimension('ray',None)
+      ncid.createDimension('gate',None)
+      ncid.createDimension('geometry',None)
+
+      timevar = ncid.createVariable('time',np.float64,('volume',),chunksizes=(1024,))
+      timevar.standard_name = "time"
+      timevar.long_name = "start time of sweep"
+      timevar.units = TIMEUNITS
+      ncid.createVariable('source_file',str,('volume',)).long_name = "input file the sweep was read from"
+      ncid.createVariable('sweep_index',np.int32,('volume',),chunksizes=(1024,)).long_name = "zero-based index of the sweep in the input file"
+      fixed_angle = ncid.createVariable('fixed_angle',np.float32,('volume',),chunksizes=(1024,))
+      fixed_angle.standard_name = "beam_target_fixed_angle"
+      fixed_angle.units = "degrees"
+      gi = ncid.createVariable('geometry_index',np.int32,('volume',),chunksizes=(1024,))
+      gi.long_name = "index of the geometry of the sweep"
+
+      ncid.createVariable('num_gates',np.int32,('geometry',)).long_name = "number of gates in each ray"
+      ncid.createVariable('num_rays',np.int32,('geometry',)).long_name = "number of rays in the sweep"
+      ncid.createVariable('meters_to_center_of_first_gate',np.float64,('geometry',)).units = "meters"
+      ncid.createVariable('meters_between_gates',np.float64,('geometry',)).units = "meters"
+
+      azi = ncid.createVariable('azimuth',np.float32,('volume','ray'),fill_value=-9999,chunksizes=(1,numTimes))
+      azi.standard_name = "beam_azimuth_angle"
+      azi.units = "degrees"
+      io.createraintype(ncid,('volume','ray','gate'),(1,numTimes,numRanges),rtfill,rtdtype,complevel,shuffle)
+    except:
+      ncid.close()
+      os.remove(fname)
+      raise
+
+    ncid.close()
+
+
+#**********************End createcampaign********************
+
+
+def appendrecords(fname,records,rtfill,title='',institution='',source='',references='',rtdtype='int8',complevel=4,shuffle=True):
+
+    #Purpose: To append records from volumerecords to the campaign store fname, creating it (with the
+    #attributes and storage options given) if it doesn't exist yet. Returns the index of the first
+    #record added along the volume dimension.
+
+    if len(records) == 0:
+      return None
+    if not os.path.exists(fname):
+      createcampaign(fname,records[0]['numRanges'],records[0]['numTimes'],rtfill,title,institution,source,references,rtdtype,complevel,shuffle)
+
+    ncid = nc4.Dataset(fname,'a')
+    try:
+      #Table of geometries already in the store.
+      geometry = list(zip(ncid.variables['num_gates'][:].tolist(),ncid.variables['num_rays'][:].tolist(),
+        ncid.variables['meters_to_center_of_first_gate'][:].tolist(),ncid.variables['meters_between_gates'][:].tolist()))
+      first = len(ncid.dimensions['volume'])
+      for (n,r) in enumerate(records):
+        g = (r['numRanges'],r['numTimes'],r['meterstoFirstGate'],r['metersBetweenGates'])
+        if g not in geometry:
+          ncid.variables['num_gates'][len(geometry)] = g[0]
+          ncid.variables['num_rays'][len(geometry)] = g[1]
+          ncid.variables['meters_to_center_of_first_gate'][len(geometry)] = g[2]
+          ncid.variables['meters_between_gates'][len(geometry)] = g[3]
+          geometry.append(g)
+
+        m = first + n
+        ncid.variables['time'][m] = r['time']
+        ncid.variables['source_file'][m] = r['source_file']
+        ncid.variables['sweep_index'][m] = r['sweep_index']
+        ncid.variables['fixed_angle'][m] = r['fixed_angle']
+        ncid.variables['geometry_index'][m] = geometry.index(g)
+        ncid.variables['azimuth'][m,0:r['numTimes']] = r['azimuth']
+        ncid.variables['raintype'][m,0:r['numTimes'],0:r['numRanges']] = np.transpose(r['raintype'])
+    finally:
+      ncid.close()
+
+    return first
+
+
+#**********************End appendrecords********************
+
+
+def readcampaign(fname,start=None,end=None):
+
+    #Purpose: To read the records of a campaign store whose time is in [start, end), given as ISO 8601
+    #strings or seconds since 1970 (None for no limit). Returns a dictionary with time, source_file,
+    #sweep_index, fixed_angle, geometry_index, azimuth and raintype (volume x ray x gate, masked where
+    #a sweep is smaller than the largest in the store) for those records, and the geometry table
+    #(num_gates, num_rays, meters_to_center_of_first_gate, meters_between_gates). Records are expected
+    #in time order, as they are when files are processed in time order; if not, they are still
+    #selected correctly, just with more reading.
+
+    limits = []
+    for t in (start,end):
+      if isinstance(t,str):
+        if np.isnan(parsetime(t)):
+          raise ValueError('Can not read the time ' + t + '. Use e.g. 2011-10-01T00:00:00.')
+        t = parsetime(t)
+      limits.append(t)
+    (start,end) = limits
+
+    ncid = nc4.Dataset(fname,'r')
+    try:
+      times = np.ma.getdata(ncid.variables['time'][:])
+      inrange = np.ones(times.shape,dtype=bool)
+      if start is not None:
+        inrange &= times >= start
+      if end is not None:
+        inrange &= times < end
+      index = np.flatnonzero(inrange)
+      #A contiguous run of records (or none) is read as one slice, anything else by index.
+      if len(index) == 0:
+        select = slice(0,0)
+      elif index[-1]-index[0]+1 == len(index):
+        select = slice(int(index[0]),int(index[-1])+1)
+      else:
+        select = index
+
+      c = {'time':times[index]}
+      for name in ('num_gates','num_rays','meters_to_center_of_first_gate','meters_between_gates'):
+        c[name] = ncid.variables[name][:]
+      for name in ('source_file','sweep_index','fixed_angle','geometry_index','azimuth','raintype'):
+        c[name] = ncid.variables[name][select]
+    finally:
+      ncid.close()
+
+    return c
+
+
+#**********************End readcampaign********************
@@ -13,7 +13,10 @@ def readcfrad(fname,sweep_used,reflName,ldrName,clutterName):
     # Read in some variables just for writing out to file. A few will be called in the algorithm.
     sls_size = 32
     starttime = 'None'
-    sweep_number1 = ncid.variables['sweep_number'][sweep_used]
+    if np.ndim(sweep_used) == 0 and not isinstance(sweep_used,str):
+      sweep_number1 = ncid.variables['sweep_number'][sweep_used]
+    else:
+      sweep_number1 = ncid.variables['sweep_number'][np.array(selectsweeps(ncid,sweep_used))]
     volume_number1 = ncid.variables['volume_number']
     time_coverage_start1 = ncid.variables['time_coverage_start']
     
@@ -53,7 +56,81 @@ def readcfrad(fname,sweep_used,reflName,ldrName,clutterName):
 #**********************End readcfrad********************
 
 
-def readsweep(ncid,sweep_start_ray_index,sweep_end_ray_index,sweep_used,fixed_angle1,reflName,ldrName,clutterName):
+def selectsweeps(ncid,sweep_used):
+
+    #Turn sweep_used into a list of zero-based sweep indices. sweep_used may be one sweep index,
+    #a list of them, or 'ppi' for every PPI sweep in the file (sweep_mode sector, azimuth_surveillance
+    #or manual_ppi).
+
+    import netCDF4 as nc4
+    import numpy as np
+
+    if isinstance(sweep_used,str):
+      if sweep_used != 'ppi':
+        raise ValueError('Unknown sweep selection ' + sweep_used + '. Use a sweep index, a list of them or ppi.')
+      modes = nc4.chartostring(np.ma.getdata(ncid.variables['sweep_mode'][:]))
+      return [k for k in range(0,len(modes)) if str(modes[k]).strip().lower() in ('sector','azimuth_surveillance','manual_ppi')]
+    if np.ndim(sweep_used) == 0:
+      return [int(sweep_used)]
+    return [int(k) for k in sweep_used]
+
+
+#**********************End selectsweeps********************
+
+
+def packedlut(var):
+
+    #If var (a netCDF4 variable) stores its data as 8- or 16-bit integers, return (lut,codetype),
+    #where lut is the float64 value (NaN for fill, missing and out-of-range values) of every stored
+    #integer, indexed by that integer viewed as codetype (the unsigned integer of the same size).
+    #The values are worked out as netCDF4 unpacks them (stored*scale_factor + add_offset). Returns
+    #None for any other variable.
+
+    import numpy as np
+
+    dtype = np.dtype(var.dtype)
+    if dtype.kind not in 'iu' or dtype.itemsize > 2:
+      return None
+    codetype = np.dtype('u'+str(dtype.itemsize))
+    attrs = var.ncattrs()
+    if dtype.kind == 'i' and str(getattr(var,'_Unsigned','false')).lower() == 'true':
+      dtype = codetype
+    stored = np.arange(0,2**(8*dtype.itemsize),dtype=codetype).view(dtype)
+
+    bad = np.zeros(stored.shape,dtype=bool)
+    for name in ('_FillValue','missing_value'):
+      if name in attrs:
+        bad |= np.isin(stored,np.asarray(var.getncattr(name)).astype(dtype))
+    if 'valid_range' in attrs:
+      bad |= (stored < var.valid_range[0]) | (stored > var.valid_range[1])
+    if 'valid_min' in attrs:
+      bad |= stored < var.valid_min
+    if 'valid_max' in attrs:
+      bad |= stored > var.valid_max
+
+    lut = stored
+    if 'scale_factor' in attrs:
+      lut = lut*var.scale_factor
+    if 'add_offset' in attrs:
+      lut = lut + var.add_offset
+    lut = np.asarray(lut,dtype=np.float64)
+    lut[bad] = np.nan
+
+    return (lut,codetype)
+
+
+#**********************End packedlut********************
+
+
+def readsweep(ncid,sweep_start_ray_index,sweep_end_ray_index,sweep_used,fixed_angle1,reflName,ldrName,clutterName,packed=False):
+
+    #With packed = True, a reflectivity stored as 8- or 16-bit integers (usually with scale_factor
+    #and add_offset) is read as the stored integers, without netCDF4 unpacking it into a masked
+    #array, and turned into dBZ with a lookup table (see packedlut). (codes,lut) is then returned as
+    #a fourth output: codes is the (numRanges x numTimes) grid of stored integers (as lut's
+    #codetype) and lut their dBZ, NaN for fill values and gates outside a ray, so that convsf can
+    #also get Z by lookup. dBZsweep is float64 either way. For any other reflectivity, the sweep is
+    #read as usual and the fourth output is None.
     
     import netCDF4 as nc4
     import numpy as np
@@ -95,25 +172,56 @@ def readsweep(ncid,sweep_start_ray_index,sweep_end_ray_index,sweep_used,fixed_an
       csweep = np.empty([numRanges,numTimes])
       csweep[:] = np.nan
 
+    #For packed reflectivity, read the stored integers into codes, with the code of a fill value
+    #(the first code whose value is NaN) for gates that aren't read. Without such a code, gates
+    #outside the rays couldn't be marked, so the sweep is read as usual.
+    lut = None
+    if packed:
+      lut = packedlut(ncid.variables[reflName])
+    if lut is not None and not np.isnan(lut[0]).any():
+      lut = None
+    if lut is not None:
+      (lut,codetype) = lut
+      codes = np.empty([numRanges,numTimes],dtype=codetype)
+      codes[:] = np.flatnonzero(np.isnan(lut))[0]
+      ncid.variables[reflName].set_auto_maskandscale(False)
+
     #Get reflectivity data, and LDR and clutter data if the latter two are present.
 
     #First we need to figure out if data is written in 1D or 2D. If in 3D, an error will occur.
     dimsize = len(ncid.variables[reflName].shape)
     if dimsize == 1:
-      for phi in range(0,len(starttimes)):
-        dBZsweep[0:lengths[phi],phi] = ncid.variables[reflName][starttimes[phi]:starttimes[phi]+lengths[phi]]
-        if 'ldrsweep' in locals():
-          ldrsweep[0:lengths[phi],phi] = ncid.variables[ldrName][starttimes[phi]:starttimes[phi]+lengths[phi]]
-        if 'csweep' in locals():
-          csweep[0:lengths[phi],phi] = ncid.variables[clutterName][starttimes[phi]:starttimes[phi]+lengths[phi]]
-      del phi
+      #Read the whole span of the sweep with one read per variable, then scatter the gates of
+      #each ray into its column of the (numRanges x numTimes) grid.
+      starttimes = np.asarray(starttimes,dtype=np.int64)
+      lengths = np.minimum(np.asarray(lengths,dtype=np.int64),numRanges)
+      first = int(starttimes.min())
+      last = int((starttimes+lengths).max())
+      gate = np.arange(0,numRanges)[:,None]
+      inray = gate < lengths
+      spanindex = (starttimes - first + gate)[inray]
+      if lut is not None:
+        codes[inray] = ncid.variables[reflName][first:last].view(codetype)[spanindex]
+      else:
+        dBZsweep[inray] = ncid.variables[reflName][first:last][spanindex]
+      if 'ldrsweep' in locals():
+        ldrsweep[inray] = ncid.variables[ldrName][first:last][spanindex]
+      if 'csweep' in locals():
+        csweep[inray] = ncid.variables[clutterName][first:last][spanindex]
     elif dimsize == 2:
-      dBZsweep = np.transpose(ncid.variables[reflName][sweep_start_ray_index[sweep_used]:sweep_end_ray_index[sweep_used]+1,:])
+      if lut is not None:
+        codes = np.transpose(ncid.variables[reflName][sweep_start_ray_index[sweep_used]:sweep_end_ray_index[sweep_used]+1,:].view(codetype))
+      else:
+        dBZsweep = np.transpose(ncid.variables[reflName][sweep_start_ray_index[sweep_used]:sweep_end_ray_index[sweep_used]+1,:])
       if 'ldrsweep' in locals():
         ldrsweep = np.transpose(ncid.variables[ldrName][sweep_start_ray_index[sweep_used]:sweep_end_ray_index[sweep_used]+1,:])
       if 'csweep' in locals():
         csweep = np.transpose(ncid.variables[clutterName][sweep_start_ray_index[sweep_used]:sweep_end_ray_index[sweep_used]+1,:])
         
+    if lut is not None:
+      ncid.variables[reflName].set_auto_maskandscale(True)
+      dBZsweep = lut[codes]
+
     #Change missing reflectivity data to NaN.
     dBZsweep[dBZsweep == refl_fill_value] = np.nan
     #If LDR data is available, NaN out any second-trip echo.
@@ -126,17 +234,75 @@ def readsweep(ncid,sweep_start_ray_index,sweep_end_ray_index,sweep_used,fixed_an
     #Get the intended elevation angle of this sweep.
     theta = fixed_angle1[sweep_used]
 
+    if packed:
+      if lut is None:
+        return(dBZsweep,numRanges,numTimes,None)
+      return(dBZsweep,numRanges,numTimes,(codes,lut))
     return(dBZsweep,numRanges,numTimes)
 
 
 #**********************End readsweep********************
 
 
-def writecfrad(fileDirOut,sdir,raintype,sls_size,volume_number1,time_coverage_start1,time_coverage_end1,lat1,lon1,alt1,sweep_number1,sweep_mode1,sweep_used,fixed_angle1,ssri1,seri1,time1,numTimes,range1,meterstoFirstGate,metersBetweenGates,azimuth1,elevation1,rtfill,starttime,ins_name,title,institution,source,references):
+def readgeometry(fname,sweep_used):
+
+    #Read just enough of a file to know the geometry of the chosen sweeps, without reading any data.
+    #Returns a list with (numRanges,numTimes,kmToFirstGate,kmBetweenGates) for each sweep.
+
+    import netCDF4 as nc4
+
+    ncid = nc4.Dataset(fname,'r')
+    try:
+      range1 = ncid.variables['range']
+      kmToFirstGate = range1.meters_to_center_of_first_gate/1000
+      kmBetweenGates = range1.meters_between_gates/1000
+      numRanges = len(range1)
+      geometry = []
+      for k in selectsweeps(ncid,sweep_used):
+        numTimes = int(ncid.variables['sweep_end_ray_index'][k])+1-int(ncid.variables['sweep_start_ray_index'][k])
+        geometry.append((numRanges,numTimes,kmToFirstGate,kmBetweenGates))
+    finally:
+      ncid.close()
+
+    return geometry
+
+
+#**********************End readgeometry********************
+
+
+def writecfrad(fileDirOut,sdir,raintype,sls_size,volume_number1,time_coverage_start1,time_coverage_end1,lat1,lon1,alt1,sweep_number1,sweep_mode1,sweep_used,fixed_angle1,ssri1,seri1,time1,range1,meterstoFirstGate,metersBetweenGates,azimuth1,elevation1,rtfill,starttime,ins_name,title,institution,source,references,rtdtype='int32',complevel=0,shuffle=False,chunkrays=None,coordprecision='double'):
 
     import netCDF4 as nc4
     import numpy as np
+
+    #rtdtype is the integer type raintype is stored as ('int8' is enough for the classes and rtfill and
+    #takes a quarter of the space of 'int32'). complevel (0-9) sets zlib compression of raintype, and
+    #shuffle = True adds the HDF5 shuffle filter. raintype is stored in chunks of chunkrays whole rays
+    #(see raintypechunks). With coordprecision = 'single', range, azimuth, elevation and fixed_angle are
+    #written as float32 instead of float64. The defaults give the same file as before these options.
+
+    #sweep_used may be a list of sweeps, in which case raintype is a list with the rain type of
+    #each. The number of rays in each sweep is taken from the shape of its raintype, so it isn't
+    #passed in. The sweeps are written one after another along the time dimension, with
+    #sweep_start_ray_index and sweep_end_ray_index pointing into the output file.
+    if np.ndim(sweep_used) == 0:
+      sweep_used = [sweep_used]
+      raintype = [raintype]
+    sweep_used = np.array(sweep_used)
+    numTimes = [raintype[k].shape[1] for k in range(0,len(sweep_used))]
+    startray = np.concatenate(([0],np.cumsum(numTimes)[:-1]))
+
+    #Rays of each sweep in the input file.
+    def sweeprays(var):
+      return np.concatenate([var[ssri1[sweep_used[k]]:ssri1[sweep_used[k]]+numTimes[k]] for k in range(0,len(sweep_used))])
     
+    if coordprecision == 'single':
+      coordtype = np.float32
+    elif coordprecision == 'double':
+      coordtype = np.float64
+    else:
+      raise ValueError('Unknown coordprecision ' + str(coordprecision) + '. Use double or single.')
+
     #Set the name of the output file
     ncname = fileDirOut+'raintype.'+sdir
 
@@ -153,9 +319,9 @@ def writecfrad(fileDirOut,sdir,raintype,sls_size,volume_number1,time_coverage_st
     ncid.instrument_name = str(ins_name)
 
     #Create dimensions
-    t = ncid.createDimension('time',raintype.shape[1])
-    r = ncid.createDimension('range',raintype.shape[0])
-    sweep = ncid.createDimension('sweep',1)
+    t = ncid.createDimension('time',sum(numTimes))
+    r = ncid.createDimension('range',raintype[0].shape[0])
+    sweep = ncid.createDimension('sweep',len(sweep_used))
     string_length_short = ncid.createDimension('string_length_short',sls_size)
 
     #Write the data and variable attributes.
@@ -190,18 +356,18 @@ def writecfrad(fileDirOut,sdir,raintype,sls_size,volume_number1,time_coverage_st
     sweep_mode[:] = sweep_mode1[sweep_used,:]
     sweep_mode.standard_name = "scan_mode_for_sweep"
     sweep_mode.options = "sector, coplane, rhi, vertical_pointing, idle, azimuth_surveillance, elevation_surveillance, sunscan, pointing, calibration, manual_ppi, manual_rhi"
-    fixed_angle = ncid.createVariable('fixed_angle',np.float,('sweep'),fill_value=-9999)
+    fixed_angle = ncid.createVariable('fixed_angle',coordtype,('sweep'),fill_value=-9999)
     fixed_angle[:] = fixed_angle1[sweep_used]
     fixed_angle.standard_name = "beam_target_fixed_angle"
     fixed_angle.units = "degrees"
     ssri = ncid.createVariable('sweep_start_ray_index',np.int32,('sweep'),fill_value=-9999)
-    ssri[:] = ssri1[sweep_used]
+    ssri[:] = startray
     ssri.standard_name = "index_of_first_ray_in_sweep"
     seri = ncid.createVariable('sweep_end_ray_index',np.int32,('sweep'),fill_value=-9999)
-    seri[:] = seri1[sweep_used]
+    seri[:] = startray + np.array(numTimes) - 1
     seri.standard_name = "index_of_last_ray_in_sweep"
     timevar = ncid.createVariable('time',np.double,('time'))
-    timevar[:] = time1[sweep_used*numTimes:(sweep_used+1)*numTimes]
+    timevar[:] = sweeprays(time1)
     timevar.standard_name = "time"
     timevar.long_name = "time in seconds since volume start"
     try: #Python 2?
@@ -209,7 +375,7 @@ def writecfrad(fileDirOut,sdir,raintype,sls_size,volume_number1,time_coverage_st
     except: #Python 3?
       timevar.units = "seconds since " + str(starttime)[2:22]
     timevar.comment = "times are relative to volume start time"
-    rangevar = ncid.createVariable('range',np.float,('range'))
+    rangevar = ncid.createVariable('range',coordtype,('range'))
     rangevar[:] = range1[:]
     rangevar.standard_name = "range_to_center_of_measurement_volume"
     rangevar.long_name = "Range from instrument to center of gate"
@@ -217,18 +383,119 @@ def writecfrad(fileDirOut,sdir,raintype,sls_size,volume_number1,time_coverage_st
     rangevar.spacing_is_constant = "True"
     rangevar.meters_to_center_of_first_gate = str(meterstoFirstGate)
     rangevar.meters_between_gates = str(metersBetweenGates)
-    azi = ncid.createVariable('azimuth',np.float,('time'),fill_value = -9999)
-    azi[:] = azimuth1[sweep_used*numTimes:(sweep_used+1)*numTimes]
+    azi = ncid.createVariable('azimuth',coordtype,('time'),fill_value = -9999)
+    azi[:] = sweeprays(azimuth1)
     azi.standard_name = "beam_azimuth_angle"
     azi.units = "degrees"
-    elev = ncid.createVariable('elevation',np.float,('time'),fill_value = -9999)
-    elev[:] = elevation1[sweep_used*numTimes:(sweep_used+1)*numTimes]
+    elev = ncid.createVariable('elevation',coordtype,('time'),fill_value = -9999)
+    elev[:] = sweeprays(elevation1)
     elev.standard_name = "beam_elevation_angle"
     elev.units = "degrees"
     elev.positive = "up"
-    finalrt = ncid.createVariable('raintype',np.int32,('time','range'),fill_value=rtfill )
-    finalrt[:,:] = (np.transpose(raintype))[:]
+    finalrt = createraintype(ncid,('time','range'),raintypechunks(chunkrays,numTimes[0],sum(numTimes),raintype[0].shape[0],0,complevel,shuffle),rtfill,rtdtype,complevel,shuffle)
+    finalrt[:,:] = np.concatenate([np.transpose(rt) for rt in raintype])
+
+    ncid.close()
+
+
+#**********************End writecfrad********************
+
+
+def raintypechunks(chunkrays,raysinsweep,numrays,numRanges,ragged,complevel,shuffle):
+
+    #Chunk shape for raintype, a whole number of rays per chunk so that a ray (or a sweep) is read or
+    #written without touching its neighbours' chunks. chunkrays = None uses one sweep of rays per chunk
+    #if the variable is compressed and leaves it contiguous otherwise. For a 2D (time x range)
+    #variable the chunk is (rays x numRanges); for a 1D (n_points) one, rays x numRanges gates.
+
+    if chunkrays is None:
+      if complevel == 0 and not shuffle:
+        return None
+      chunkrays = raysinsweep
+    chunkrays = max(1,min(int(chunkrays),numrays))
+    if ragged == 1:
+      return (chunkrays*numRanges,)
+    return (chunkrays,numRanges)
+
+
+#**********************End raintypechunks********************
+
+
+def createraintype(ncid,dims,chunks,rtfill,rtdtype,complevel,shuffle):
+
+    #Create the raintype variable of an open file, with the given dimensions, chunk shape (None for
+    #contiguous), integer type and compression. The variable is returned ready for the data.
+
+    import numpy as np
+
+    rtdtype = np.dtype(rtdtype)
+    if rtdtype.kind not in 'iu' or not np.iinfo(rtdtype).min <= rtfill <= np.iinfo(rtdtype).max:
+      raise ValueError('raintype can not be stored as ' + str(rtdtype) + ' with fill value ' + str(rtfill) + '.')
+    if chunks is None:
+      finalrt = ncid.createVariable('raintype',rtdtype,dims,fill_value=rtfill,contiguous=True)
+    else:
+      finalrt = ncid.createVariable('raintype',rtdtype,dims,fill_value=rtfill,zlib=complevel > 0,complevel=max(complevel,1),shuffle=shuffle,chunksizes=chunks)
     finalrt.long_name = "rain type classification"
     finalrt.units = "unitless"
 
-    ncid.close()
+    return finalrt
+
+
+#**********************End createraintype********************
+
+
+def appendcfrad(fname,raintype,sweep_used,rtfill,rtdtype='int32',complevel=0,shuffle=False,chunkrays=None):
+
+    #Write the rain type into the CfRadial file it was classified from (fname), as a raintype field
+    #next to the reflectivity, instead of copying the metadata to a new file. sweep_used and raintype
+    #are as in writecfrad; rays of other sweeps are left as rtfill. If the file stores its fields 1D
+    #(n_points, with ray_start_index and ray_n_gates), so is raintype, otherwise it is (time x range).
+    #If the file already has a raintype field (e.g. from an earlier run), the chosen sweeps are
+    #overwritten in it and the other options are ignored. The file must not be open elsewhere.
+
+    import netCDF4 as nc4
+    import numpy as np
+
+    if np.ndim(sweep_used) == 0:
+      sweep_used = [sweep_used]
+      raintype = [raintype]
+
+    ncid = nc4.Dataset(fname,'a')
+    try:
+      ssri = np.asarray(ncid.variables['sweep_start_ray_index'][:],dtype=np.int64)
+      numRanges = len(ncid.variables['range'])
+      numrays = len(ncid.dimensions['time'])
+      ragged = 'n_points' in ncid.dimensions and 'ray_start_index' in ncid.variables and 'ray_n_gates' in ncid.variables
+      if 'raintype' in ncid.variables:
+        finalrt = ncid.variables['raintype']
+      elif ragged:
+        chunks = raintypechunks(chunkrays,raintype[0].shape[1],numrays,numRanges,1,complevel,shuffle)
+        if chunks is not None:
+          chunks = (min(chunks[0],len(ncid.dimensions['n_points'])),)
+        finalrt = createraintype(ncid,('n_points',),chunks,rtfill,rtdtype,complevel,shuffle)
+      else:
+        finalrt = createraintype(ncid,('time','range'),raintypechunks(chunkrays,raintype[0].shape[1],numrays,numRanges,0,complevel,shuffle),rtfill,rtdtype,complevel,shuffle)
+      if 'comment' not in finalrt.ncattrs():
+        finalrt.comment = "NO ECHO = 0, STRATIFORM = 1, CONVECTIVE = 2, MIXED = 3, ISOLATED CONVECTIVE CORE = 4, ISOLATED CONVECTIVE FRINGE = 5, WEAK ECH0 = 6"
+
+      for k in range(0,len(sweep_used)):
+        first = int(ssri[sweep_used[k]])
+        numTimes = raintype[k].shape[1]
+        if len(finalrt.dimensions) == 1:
+          #Gather the gates of each ray into one span of n_points, as readsweep scatters them.
+          starttimes = np.asarray(ncid.variables['ray_start_index'][first:first+numTimes],dtype=np.int64)
+          lengths = np.minimum(np.asarray(ncid.variables['ray_n_gates'][first:first+numTimes],dtype=np.int64),raintype[k].shape[0])
+          start = int(starttimes.min())
+          gate = np.arange(0,raintype[k].shape[0])[:,None]
+          inray = gate < lengths
+          span = np.empty(int((starttimes+lengths).max())-start,dtype=finalrt.dtype)
+          span[:] = rtfill
+          span[(starttimes - start + gate)[inray]] = raintype[k][inray]
+          finalrt[start:start+len(span)] = span
+        else:
+          finalrt[first:first+numTimes,:] = np.transpose(raintype[k])
+    finally:
+      ncid.close()
+
+
+#**********************End appendcfrad********************
@@ -0,0 +1,169 @@
+"""
+ ****Rain-type Classification code of Powell et al. (2016, JTECH): Classifier object*****#
+#Description: RainTypeClassifier holds one set of algorithm parameters and the masks, sectorarea
+#   and ring limits of every radar geometry it has seen, so services and notebooks can classify
+#   any number of sweeps without passing the masks around or rebuilding them.
+#
+#   >> import classifier
+#   >> rtc = classifier.RainTypeClassifier(truncZconvthres=40)
+#   >> raintype = rtc.classify(dBZsweep,(kmToFirstGate,kmBetweenGates))
+#
+#   dBZsweep is a (range x azimuth) reflectivity sweep in dBZ, with NaN where there is no data,
+#   already in memory (e.g. from a decoder), so no CfRadial file is needed. Optional LDR and
+#   clutter-flag arrays of the same shape can be given as well:
+#
+#   >> raintype = rtc.classify(dBZsweep,(kmToFirstGate,kmBetweenGates),ldr=ldrsweep,clutter=csweep)
+#
+#   Data stored (azimuth x range), as in a Py-ART radar object, can be passed transposed
+#   (e.g. dbz.T); with copy=False a floating-point sweep is then classified without being copied.
+"""
+from __future__ import division   #For python2 users only.
+import numpy as np
+import algorithm as alg
+import profiler as prof
+import rtfunctions as rt
+
+#Default parameters, the same as in runraintype.py. See there for what each one means.
+defaults = dict(minZdiff=20,deepcoszero=40,shallowconvmin=28,truncZconvthres=42,dBZformaxconvradius=45,
+  mindbzuse=-50,weakechothres=7,backgrndradius=5,maxConvRadius=10,minsize=8,startslope=50,maxsize=2000,
+  maskcacheDir=None,bgengine='gather',backend='reference',cropecho=True,precision='double',CS_CORE=8,ISO_CS_CORE=9,NO_ECHO=0,STRATIFORM=1,CONVECTIVE=2,MIXED=3,
+  ISO_CONV_CORE=4,ISO_CONV_FRINGE=5,WEAK_ECHO=6,rtfill=-99)
+
+
+class RainTypeClassifier(object):
+
+    #Purpose: To classify sweeps with a fixed set of parameters. params is a dictionary with any of
+    #the keys in defaults (others, such as file names from runraintype.params, are ignored), and
+    #keyword arguments override it. masks is an optional dictionary of (maskcell,convcell,sectorarea,
+    #minR,maxR) keyed by rt.maskcachekey, which can be shared between classifiers with the same
+    #backgrndradius and maxConvRadius; geometries not in it are added to it as they are seen.
+
+    def __init__(self,params=None,masks=None,**kwargs):
+        self.params = dict(defaults)
+        if params is not None:
+          self.params.update((k,v) for (k,v) in params.items() if k in defaults)
+        for k in kwargs:
+          if k not in defaults:
+            raise TypeError('Unknown parameter ' + str(k) + '.')
+        self.params.update(kwargs)
+        if masks is None:
+          masks = {}
+        self.masks = masks
+
+    def geometry(self,numRanges,numTimes,kmToFirstGate,kmBetweenGates):
+
+        #Purpose: To return (maskcell,convcell,sectorarea,minR,maxR) for a sweep of numRanges x
+        #numTimes gates, making them (or loading them from params['maskcacheDir']) the first time.
+
+        p = self.params
+        key = rt.maskcachekey(numRanges,numTimes,kmToFirstGate,kmBetweenGates,p['backgrndradius'],p['maxConvRadius'])
+        if key not in self.masks:
+          self.masks[key] = alg.getmasks(kmToFirstGate,kmBetweenGates,numRanges,numTimes,p['backgrndradius'],p['maxConvRadius'],p['maskcacheDir'])
+        return self.masks[key]
+
+    def prepare(self,dbz,ldr=None,clutter=None,copy=True):
+
+        #Purpose: To return dbz as the floating-point sweep the algorithm works on, with the gates
+        #flagged in ldr or clutter NaNed out. The arguments are as in background.
+
+        p = self.params
+        dBZsweep = np.asanyarray(dbz)
+        if p['precision'] == 'single':
+          dBZsweep = dBZsweep.astype(np.float32,copy=copy)
+        elif dBZsweep.dtype.kind != 'f':
+          dBZsweep = dBZsweep.astype(np.float64)
+        elif copy:
+          #Floating-point sweeps keep their dtype, as when convsf is given a sweep from readsweep.
+          dBZsweep = dBZsweep.copy()
+        if ldr is not None:
+          dBZsweep[np.asarray(ldr) > 0] = np.nan
+        if clutter is not None:
+          dBZsweep[np.asarray(clutter) == 1] = np.nan
+        return dBZsweep
+
+    def background(self,dbz,geometry,ldr=None,clutter=None,copy=True,packed=None,timings=None,crop=False):
+
+        #Purpose: To compute the background reflectivity of a sweep. geometry is
+        #(kmToFirstGate,kmBetweenGates) in km. ldr and clutter are optional arrays the same shape
+        #as dbz: gates with LDR > 0 (second-trip echo) or clutter == 1 are treated as missing, as
+        #in cfrad_io.readsweep. Returns (background,dBZsweep), where dBZsweep is dbz with the data
+        #close to the radar and any flagged gates NaNed out, as used by convectivecore.
+        #With copy = True dbz is not changed. With copy = False, a dbz that is already floating point
+        #(float32 with params['precision'] = 'single') is used as is (any memory layout, so a
+        #transposed view is fine) and NaNed out in place instead of copied.
+        #packed is the (codes,lut) cfrad_io.readsweep returns with packed = True for dbz, if any, so
+        #that Z is looked up rather than computed (see algorithm.convsf). timings is as in classify.
+        #With crop = True the background is only computed where convectivecore uses it, around the
+        #echo of at least params['weakechothres'], and is NaN elsewhere (see algorithm.convsf).
+
+        p = self.params
+        (kmToFirstGate,kmBetweenGates) = geometry
+        dBZsweep = self.prepare(dbz,ldr,clutter,copy)
+        (numRanges,numTimes) = dBZsweep.shape
+        with prof.stage(timings,'masks'):
+          (maskcell,convcell,sectorarea,minR,maxR) = self.geometry(numRanges,numTimes,kmToFirstGate,kmBetweenGates)
+        if prof.counting(timings):
+          #Number of points in the background masks of all the rings, a measure of the work in convsf.
+          prof.count(timings,'maskpoints',sum(len(maskcell[R][0]) for R in range(minR,maxR+1)))
+        with prof.stage(timings,'background'):
+          (background,dBZsweep,minR,maxR) = alg.convsf(kmToFirstGate,kmBetweenGates,numRanges,numTimes,p['backgrndradius'],p['maxConvRadius'],0,dBZsweep,1,0,maskcell,p['maskcacheDir'],p['bgengine'],False,p['precision'],packed,p['backend'],p['weakechothres'] if crop else None)
+        return (background,dBZsweep)
+
+    def noecho(self,dBZsweep,geometry):
+
+        #Purpose: To classify a sweep from prepare that has no echo of at least weakechothres, other
+        #than close to the radar (where it is NaNed out, as in convsf). Such a sweep is NO_ECHO where
+        #there is no data, WEAK_ECHO elsewhere and rtfill beyond maxR, as convectivecore would make it,
+        #so nothing else need be computed. Returns None if the sweep has echo.
+
+        p = self.params
+        (numRanges,numTimes) = dBZsweep.shape
+        (minR,maxR) = alg.ringlimits(geometry[1],numRanges,p['backgrndradius'])
+        refl = np.ma.getdata(dBZsweep)
+        if np.any(refl[minR+1:] >= p['weakechothres']):
+          return None
+        #Masked gates are classified by their data, but NaN data under a mask isn't classified NO_ECHO.
+        if np.ma.is_masked(dBZsweep) and np.any(np.isnan(refl[np.ma.getmaskarray(dBZsweep)])):
+          return None
+
+        dBZsweep[0:minR+1,:] = np.nan
+        refl = np.ma.getdata(dBZsweep)
+        if p['precision'] == 'single':
+          raintype = np.empty(refl.shape,dtype=np.int8)
+        else:
+          raintype = np.empty(refl.shape,dtype=int)
+        raintype[:] = p['WEAK_ECHO']
+        raintype[np.isnan(refl)] = p['NO_ECHO']
+        raintype[maxR:numRanges,:] = p['rtfill']
+        return raintype
+
+    def classify(self,dbz,geometry,timings=None,ldr=None,clutter=None,copy=True,packed=None):
+
+        #Purpose: To classify a (range x azimuth) reflectivity sweep in dBZ. geometry is
+        #(kmToFirstGate,kmBetweenGates) in km. ldr, clutter, copy and packed are as in background.
+        #Returns the rain-type array, the same shape as dbz. Nothing is read from or written to
+        #disk (unless params['maskcacheDir'] is set). If timings is a dictionary (or a
+        #profiler.Profiler), the time spent in the 'masks', 'background', 'label', 'cluster' and
+        #'mixed' stages is added to it (see profiler.py).
+        #With params['cropecho'], a sweep with no echo of at least weakechothres is classified
+        #without computing anything else (see noecho), and the background is only computed around
+        #the echo of other sweeps (see background). The rain type is the same either way.
+
+        p = self.params
+        dBZsweep = self.prepare(dbz,ldr,clutter,copy)
+        if p['cropecho']:
+          raintype = self.noecho(dBZsweep,geometry)
+          if raintype is not None:
+            prof.count(timings,'noecho',1)
+            return raintype
+        #dBZsweep is already a floating-point copy (if asked for), so it needn't be copied again.
+        (background,dBZsweep) = self.background(dBZsweep,geometry,None,None,False,packed,timings,p['cropecho'])
+        (numRanges,numTimes) = dBZsweep.shape
+        (maskcell,convcell,sectorarea,minR,maxR) = self.geometry(numRanges,numTimes,geometry[0],geometry[1])
+
+        raintype = alg.convectivecore(background,dBZsweep,p['minZdiff'],p['CS_CORE'],p['ISO_CS_CORE'],p['CONVECTIVE'],p['STRATIFORM'],p['MIXED'],p['WEAK_ECHO'],p['ISO_CONV_CORE'],p['ISO_CONV_FRINGE'],p['NO_ECHO'],p['dBZformaxconvradius'],p['maxConvRadius'],p['weakechothres'],p['deepcoszero'],p['minsize'],p['maxsize'],p['startslope'],p['shallowconvmin'],p['truncZconvthres'],p['mindbzuse'],sectorarea,convcell,maxR,numRanges,numTimes,p['rtfill'],timings,p['precision'],None,p['backend'])
+
+        return raintype
+
+
+#**********************End RainTypeClassifier********************
@@ -0,0 +1,77 @@
+"""
+ ****Rain-type Classification code of Powell et al. (2016, JTECH): Parameter ensembles*****#
+#Description: Classifies one sweep with every combination of a grid of parameter values, for
+#   tuning the algorithm to a radar (the classification is sensitive to truncZconvthres in
+#   particular). Intermediates shared by several members are computed once: the background
+#   for each backgrndradius and maxConvRadius, and the echo objects for each weakechothres
+#   as well. Only the threshold-dependent parts of convectivecore and makedBZcluster are run
+#   for every member.
+#
+#   >> import ensemble
+#   >> (raintype,members) = ensemble.classifyensemble(dBZsweep,(kmToFirstGate,kmBetweenGates),
+#   ..      {'truncZconvthres':[38,40,42,44],'backgrndradius':[5,11]})
+#   >> raintype.shape      #(8 x numRanges x numTimes); members[k] are the values of member k
+"""
+from __future__ import division   #For python2 users only.
+import itertools
+import numpy as np
+import algorithm as alg
+import classifier
+import profiler as prof
+import rtfunctions as rt
+
+#Parameters the background (and the sweep it is computed from) depends on.
+BACKGROUND = ('backgrndradius','maxConvRadius','bgengine','backend','precision','maskcacheDir')
+
+
+def members(grid):
+
+    #Purpose: To list every combination of the values in grid (a dictionary of parameter name to
+    #list of values), as dictionaries. The last parameter varies fastest.
+
+    names = list(grid.keys())
+    return [dict(zip(names,values)) for values in itertools.product(*[list(grid[k]) for k in names])]
+
+
+#**********************End members********************
+
+
+def classifyensemble(dbz,geometry,grid,params=None,masks=None,ldr=None,clutter=None,timings=None):
+
+    #Purpose: To classify a (range x azimuth) reflectivity sweep in dBZ with every member of a
+    #parameter grid. geometry, ldr and clutter are as in RainTypeClassifier.classify, params are the
+    #parameters not in grid (see RainTypeClassifier) and masks is a dictionary of masks shared by the
+    #members (see RainTypeClassifier). Returns (raintype,members), where raintype is
+    #(members x numRanges x numTimes) and members is the list from members(grid). Each member gives
+    #the same result as RainTypeClassifier(params,**member).classify. If timings is a dictionary, the
+    #time spent in each stage is added to it, as in classify.
+
+    if masks is None:
+      masks = {}
+    backgrounds = {}
+    labels = {}
+    raintypes = []
+    grid = members(grid)
+    for member in grid:
+      rtc = classifier.RainTypeClassifier(params,masks,**member)
+      p = rtc.params
+
+      #Background and the sweep it was computed from, once per background setting.
+      key = tuple(p[k] for k in BACKGROUND)
+      if key not in backgrounds:
+        backgrounds[key] = rtc.background(dbz,geometry,ldr,clutter,timings=timings)
+      (background,dBZsweep) = backgrounds[key]
+      (numRanges,numTimes) = dBZsweep.shape
+      (maskcell,convcell,sectorarea,minR,maxR) = rtc.geometry(numRanges,numTimes,geometry[0],geometry[1])
+
+      #Echo objects, once per background setting and weakechothres.
+      if key + (p['weakechothres'],) not in labels:
+        with prof.stage(timings,'label'):
+          labels[key + (p['weakechothres'],)] = rt.echolabels(dBZsweep,p['weakechothres'],sectorarea,numTimes)
+
+      raintypes.append(alg.convectivecore(background,dBZsweep,p['minZdiff'],p['CS_CORE'],p['ISO_CS_CORE'],p['CONVECTIVE'],p['STRATIFORM'],p['MIXED'],p['WEAK_ECHO'],p['ISO_CONV_CORE'],p['ISO_CONV_FRINGE'],p['NO_ECHO'],p['dBZformaxconvradius'],p['maxConvRadius'],p['weakechothres'],p['deepcoszero'],p['minsize'],p['maxsize'],p['startslope'],p['shallowconvmin'],p['truncZconvthres'],p['mindbzuse'],sectorarea,convcell,maxR,numRanges,numTimes,p['rtfill'],timings,p['precision'],labels[key + (p['weakechothres'],)],p['backend']))
+
+    return (np.stack(raintypes),grid)
+
+
+#**********************End classifyensemble********************
@@ -0,0 +1,307 @@
+"""
+ ****Rain-type Classification code of Powell et al. (2016, JTECH): Equivalence checks*****#
+#Description: Checks that the classification gives the same rain types as the original code of
+#   Powell et al. (2016), kept frozen in original.py, on small sweeps made to hit edge cases (a
+#   single core, cores at the 0/360 degree seam, clear air), synthetic sweeps (the cases in
+#   benchmark.py) and sweeps from CfRadial files. For every sweep it reports the agreement in each
+#   class, where the gates that differ are, the error in the background reflectivity and how much
+#   faster the code checked is than the original.
+#
+#   The code checked is a RainTypeClassifier with the parameters in runraintype.py, and any others
+#   given as candidate parameters (another backend, bgengine or precision, see backends.py and
+#   runraintype.py):
+#
+#   >> python -W ignore equivalence.py
+#   >> python -W ignore equivalence.py backend=numba --maxbgerr 1e-6
+#   >> python -W ignore equivalence.py bgengine=prefixsum --maxdiff 10 --files /data/cfrad.*.nc
+#   >> python -W ignore equivalence.py precision=single --cases base_2d --output single.json
+#
+#   The exit status is 1 if any sweep has more than maxdiff gates (0 by default) that differ or a
+#   background error above maxbgerr dBZ, so it can be run as a check before merging performance work.
+#   The same check can be run as a regression test with regression, or with pytest (which runs
+#   test_original):
+#
+#   >> python -m pytest -q equivalence.py
+"""
+from __future__ import division   #For python2 users only.
+import argparse
+import json
+import sys
+import time
+import numpy as np
+import batch
+import benchmark
+import classifier
+import original
+import runraintype
+import synthetic
+
+#Names of the classes in the report, by the parameter holding each code.
+CLASSES = ('NO_ECHO','STRATIFORM','CONVECTIVE','MIXED','ISO_CONV_CORE','ISO_CONV_FRINGE','WEAK_ECHO','rtfill')
+
+#Edge cases: (name,numTimes,cores as (range index,azimuth index)). Every sweep is 200 gates of
+#0.15 km, 20 dBZ everywhere, with 55 dBZ at the cores.
+EDGES = (('one_core',360,[(100,50)]),('one_core_odd',361,[(100,50)]),('seam_core',360,[(100,0)]),
+  ('same_ring_cores',360,[(100,50),(100,200)]),('two_cores',360,[(100,50),(150,200)]),
+  ('clear_air',360,[]),('no_data',360,None))
+
+
+class Original(object):
+
+    #Purpose: To run the original code (original.py) the way the original runraintype.py did, with
+    #the classify and background methods of RainTypeClassifier. The masks of each geometry are made
+    #the first time it is seen and reused, as there with repeatmask = 0.
+
+    def __init__(self,params=None):
+        self.params = classifier.RainTypeClassifier(params).params
+        self.masks = {}
+
+    def background(self,dbz,geometry):
+
+        #Purpose: To return (background,dBZsweep), as RainTypeClassifier.background does.
+
+        p = self.params
+        (numRanges,numTimes) = dbz.shape
+        key = (numRanges,numTimes) + tuple(geometry)
+        #The original convsf NaNs out dBZsweep close to the radar in place.
+        dBZsweep = dbz.copy()
+        if key not in self.masks:
+          (maskcell,convcell,background,sectorarea,dBZsweep,minR,maxR) = original.convsf(geometry[0],geometry[1],numRanges,numTimes,p['backgrndradius'],p['maxConvRadius'],0,dBZsweep,0,1,None)
+          self.masks[key] = (maskcell,convcell,sectorarea,maxR)
+        else:
+          (background,dBZsweep,minR,maxR) = original.convsf(geometry[0],geometry[1],numRanges,numTimes,p['backgrndradius'],p['maxConvRadius'],0,dBZsweep,1,0,self.masks[key][0])
+        return (background,dBZsweep)
+
+    def classify(self,dbz,geometry):
+
+        #Purpose: To classify a (range x azimuth) reflectivity sweep in dBZ with the original code.
+
+        p = self.params
+        (background,dBZsweep) = self.background(dbz,geometry)
+        (numRanges,numTimes) = dBZsweep.shape
+        (maskcell,convcell,sectorarea,maxR) = self.masks[(numRanges,numTimes) + tuple(geometry)]
+        return original.convectivecore(background,dBZsweep,p['minZdiff'],p['CS_CORE'],p['ISO_CS_CORE'],p['CONVECTIVE'],p['STRATIFORM'],p['MIXED'],p['WEAK_ECHO'],p['ISO_CONV_CORE'],p['ISO_CONV_FRINGE'],p['NO_ECHO'],p['dBZformaxconvradius'],p['maxConvRadius'],p['weakechothres'],p['deepcoszero'],p['minsize'],p['maxsize'],p['startslope'],p['shallowconvmin'],p['truncZconvthres'],p['mindbzuse'],sectorarea,convcell,maxR,numRanges,numTimes,p['rtfill'])
+
+
+#**********************End Original********************
+
+
+def edgecorpus(cases=None):
+
+    #Purpose: To make the sweeps of the EDGES cases named in cases (all by default). Returns a list
+    #of (name,dBZsweep,(kmToFirstGate,kmBetweenGates)).
+
+    sweeps = []
+    for (name,numTimes,cores) in EDGES:
+      if cases is not None and name not in cases:
+        continue
+      dBZ = np.empty([200,numTimes])
+      if cores is None:
+        dBZ[:] = np.nan
+      elif len(cores) == 0:
+        #Echo, but all of it below weakechothres.
+        dBZ[:] = 3.0
+      else:
+        dBZ[:] = 20.0
+        for (R,t) in cores:
+          dBZ[R,t] = 55.0
+      sweeps.append((name,dBZ,(0.075,0.15)))
+    return sweeps
+
+
+def syntheticcorpus(cases=None,seeds=(0,)):
+
+    #Purpose: To make the synthetic sweeps of the benchmark.py cases named in cases (all by default),
+    #one for each random seed. Returns a list of (name,dBZsweep,(kmToFirstGate,kmBetweenGates)).
+
+    sweeps = []
+    for c in benchmark.CASES:
+      if cases is not None and c['name'] not in cases:
+        continue
+      for seed in seeds:
+        dBZ = synthetic.makesweep(c['numRanges'],c['numTimes'],c['kmBetweenGates'],c['kmToFirstGate'],seed,c['numcells'],c['shieldradius'],c['numshields'])
+        sweeps.append((c['name']+'/seed'+str(seed),dBZ,(c['kmToFirstGate'],c['kmBetweenGates'])))
+    return sweeps
+
+
+def filecorpus(fnames,params):
+
+    #Purpose: To read the sweeps params['sweep_used'] of each CfRadial file in fnames, as the batch
+    #does. Returns a list of (name,dBZsweep,(kmToFirstGate,kmBetweenGates)).
+
+    sweeps = []
+    for fname in fnames:
+      volume = batch.readfile(fname,dict(params,packedrefl=0))
+      volume['ncid'].close()
+      for sweep in volume['sweeps']:
+        sweeps.append((fname+'/sweep'+str(sweep['sweep_used']),sweep['dBZsweep'],(volume['kmToFirstGate'],volume['kmBetweenGates'])))
+    return sweeps
+
+
+#**********************End corpus********************
+
+
+def timeclassify(rtc,dbz,geometry,repeat):
+
+    #Purpose: To classify a sweep once untimed (so compiling and building masks don't count) and
+    #then repeat times. Returns (raintype,best wall time). With repeat = 0 the first run is timed.
+
+    t0 = time.perf_counter()
+    raintype = rtc.classify(dbz,geometry)
+    if repeat == 0:
+      return (raintype,time.perf_counter()-t0)
+    best = np.inf
+    for i in range(0,repeat):
+      t0 = time.perf_counter()
+      rtc.classify(dbz,geometry)
+      best = min(best,time.perf_counter()-t0)
+    return (raintype,best)
+
+
+def comparesweep(name,dbz,geometry,candidate,params=None,repeat=3,maxgates=100):
+
+    #Purpose: To classify a sweep with the original code and with the candidate parameters and
+    #compare them. params are the parameters of both (see RainTypeClassifier). Returns a dictionary with
+    #the number of gates that differ, the agreement in each class (gates of the class in the
+    #original ('reference'), in the candidate and in both), the first maxgates differing gates as [ray index,
+    #range index, range in km, reference class, candidate class], statistics of the difference
+    #between the backgrounds (in dBZ, where both have one) and the time each took.
+
+    ref = Original(params)
+    cand = classifier.RainTypeClassifier(ref.params,None,**candidate)
+    p = ref.params
+
+    (rtref,tref) = timeclassify(ref,dbz,geometry,repeat)
+    (rtcand,tcand) = timeclassify(cand,dbz,geometry,repeat)
+    rtref = np.asarray(rtref)
+    rtcand = np.asarray(rtcand)
+
+    classes = {}
+    for c in CLASSES:
+      inref = rtref == p[c]
+      incand = rtcand == p[c]
+      classes[c] = dict(reference=int(np.count_nonzero(inref)),candidate=int(np.count_nonzero(incand)),agree=int(np.count_nonzero(inref & incand)))
+
+    (I,J) = np.nonzero(rtref != rtcand)
+    gates = [[int(J[k]),int(I[k]),float(geometry[0]+geometry[1]*I[k]),int(rtref[I[k],J[k]]),int(rtcand[I[k],J[k]])] for k in range(0,min(len(I),maxgates))]
+
+    #Backgrounds, compared where both are defined; gates where only one is are counted.
+    bgref = np.asarray(ref.background(dbz,geometry)[0],dtype=np.float64)
+    bgcand = np.asarray(cand.background(dbz,geometry)[0],dtype=np.float64)
+    both = ~np.isnan(bgref) & ~np.isnan(bgcand)
+    err = np.abs(bgcand[both]-bgref[both])
+    background = dict(maxabs=float(err.max()) if len(err) > 0 else 0.0,meanabs=float(err.mean()) if len(err) > 0 else 0.0,
+      rms=float(np.sqrt(np.mean(err**2))) if len(err) > 0 else 0.0,nanmismatch=int(np.count_nonzero(np.isnan(bgref) != np.isnan(bgcand))))
+
+    return dict(sweep=name,shape=list(rtref.shape),differing=int(len(I)),agreement=1-len(I)/rtref.size,classes=classes,gates=gates,
+      background=background,reference_s=tref,candidate_s=tcand,speedup=tref/max(tcand,1e-12))
+
+
+#**********************End comparesweep********************
+
+
+def passes(result,maxdiff=0,maxbgerr=None):
+
+    #Purpose: To check whether a result from comparesweep is within the tolerances: at most maxdiff
+    #gates differ and (if maxbgerr is given) the backgrounds differ by at most maxbgerr dBZ and are
+    #missing at the same gates.
+
+    if result['differing'] > maxdiff:
+      return False
+    if maxbgerr is not None and (result['background']['maxabs'] > maxbgerr or result['background']['nanmismatch'] > 0):
+      return False
+    return True
+
+
+def report(results,maxdiff=0,maxbgerr=None):
+
+    #Purpose: To print a line for each sweep compared and the classes and gates of those that differ.
+    #Returns the number of sweeps that don't pass.
+
+    failed = 0
+    print('%-28s %9s %10s %10s %9s %8s %5s' % ('sweep','differing','agreement','bg max','bg rms','speedup',''))
+    for r in results:
+      ok = passes(r,maxdiff,maxbgerr)
+      failed += not ok
+      print('%-28s %9d %10.6f %10.2e %9.2e %7.2fx %5s' % (r['sweep'],r['differing'],r['agreement'],r['background']['maxabs'],r['background']['rms'],r['speedup'],'ok' if ok else 'FAIL'))
+      if r['differing'] > 0:
+        for (c,n) in sorted(r['classes'].items()):
+          if n['reference'] != n['agree'] or n['candidate'] != n['agree']:
+            print('    %-16s reference %8d candidate %8d both %8d' % (c,n['reference'],n['candidate'],n['agree']))
+        for (ray,gate,km,a,b) in r['gates'][0:10]:
+          print('    ray %4d gate %4d (%7.2f km): %d -> %d' % (ray,gate,km,a,b))
+    return failed
+
+
+#**********************End report********************
+
+
+def regression(candidate=None,params=None,cases=None,seeds=(0,),fnames=(),maxdiff=0,maxbgerr=None,repeat=0):
+
+    #Purpose: To run the checks as a regression test: compare the candidate parameters (none, for
+    #the parameters as they are) with the original code on the edge and synthetic cases named in
+    #cases (all by default) and the files in fnames, and raise an AssertionError naming the sweeps
+    #that don't pass (see passes). params default to those in runraintype.py. Returns the results.
+
+    if candidate is None:
+      candidate = {}
+    if params is None:
+      params = runraintype.params
+    corpus = edgecorpus(cases) + syntheticcorpus(cases,seeds) + filecorpus(fnames,params)
+    results = [comparesweep(name,dbz,geometry,candidate,params,repeat) for (name,dbz,geometry) in corpus]
+    failed = [r['sweep'] for r in results if not passes(r,maxdiff,maxbgerr)]
+    if len(failed) > 0:
+      report(results,maxdiff,maxbgerr)
+      raise AssertionError('Not the same as the original code: ' + ', '.join(failed))
+    return results
+
+
+def test_original():
+
+    #Purpose: For pytest. Checks the default parameters against the original code on the edge cases
+    #and one synthetic sweep with echo near the radar and one without.
+
+    regression(cases=[c[0] for c in EDGES] + ['base_2d','clear'])
+
+
+def parsecandidate(settings):
+
+    #Purpose: To turn name=value strings into candidate parameters. Values are numbers if they can be.
+
+    candidate = {}
+    for s in settings:
+      (name,value) = s.split('=',1)
+      for kind in (int,float):
+        try:
+          value = kind(value)
+          break
+        except ValueError:
+          pass
+      candidate[name] = value
+    return candidate
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check that the classification (with any candidate parameters) is the same as the original code.')
+    parser.add_argument('candidate',nargs='*',help='candidate parameters as name=value (e.g. backend=numba)')
+    parser.add_argument('--cases',nargs='*',default=None,help='names of the edge and synthetic cases to run (default: all)')
+    parser.add_argument('--seeds',type=int,default=1,help='synthetic sweeps per case (default: 1)')
+    parser.add_argument('--files',nargs='*',default=[],help='CfRadial files to check as well')
+    parser.add_argument('--repeat',type=int,default=3,help='timed runs of each engine per sweep (default: 3)')
+    parser.add_argument('--maxdiff',type=int,default=0,help='gates per sweep allowed to differ (default: 0)')
+    parser.add_argument('--maxbgerr',type=float,default=None,help='largest background difference allowed, in dBZ (default: not checked)')
+    parser.add_argument('--output',default=None,help='file to save the full results to')
+    args = parser.parse_args()
+
+    params = runraintype.params
+    candidate = parsecandidate(args.candidate)
+    corpus = edgecorpus(args.cases) + syntheticcorpus(args.cases,range(0,args.seeds)) + filecorpus(args.files,params)
+    results = [comparesweep(name,dbz,geometry,candidate,params,args.repeat) for (name,dbz,geometry) in corpus]
+    failed = report(results,args.maxdiff,args.maxbgerr)
+
+    if args.output is not None:
+      with open(args.output,'w') as f:
+        json.dump(dict(time=time.strftime('%Y-%m-%dT%H:%M:%S'),candidate=candidate,reference='original',maxdiff=args.maxdiff,
+          maxbgerr=args.maxbgerr,results=results),f,indent=1)
+
+    sys.exit(1 if failed > 0 else 0)
@@ -0,0 +1,136 @@
+"""
+ ****Rain-type Classification code of Powell et al. (2016, JTECH): Processed-file manifest*****#
+#Description: A record of which input files have been classified, so that a batch can be rerun
+#   (e.g. after a crash, or with more files added) without redoing the files already done. For
+#   each input file the manifest keeps a fingerprint of its contents, a hash of the parameters it
+#   was classified with, the output file and whether it failed. A file is skipped if it was done
+#   with the same parameters, hasn't changed since and its output is still there; failed files are
+#   retried.
+#
+#   The manifest is a text file with one JSON entry per line, appended as each file finishes, so
+#   it is up to date even if a run is killed. Set manifestfile (and failurelog, for a log of the
+#   errors) in runraintype.py to use one.
+"""
+from __future__ import division   #For python2 users only.
+import hashlib
+import json
+import os
+import time
+
+#Parameters that don't change the output, so don't go into paramhash.
+IGNORED = ('repeatmask','maskcacheDir','manifestfile','failurelog','profilelog','profilememory','pipelinedepth','cropecho')
+
+
+def paramhash(params):
+
+    #Purpose: To return a hash of the parameters that affect the output.
+
+    used = dict((k,v) for (k,v) in params.items() if k not in IGNORED)
+    return hashlib.sha1(json.dumps(used,sort_keys=True,default=str).encode('utf-8')).hexdigest()
+
+
+#**********************End paramhash********************
+
+
+def filehash(fname,blocksize=1<<20):
+
+    #Purpose: To return the SHA-1 of the contents of a file, read blocksize bytes at a time.
+
+    h = hashlib.sha1()
+    with open(fname,'rb') as f:
+      for block in iter(lambda: f.read(blocksize),b''):
+        h.update(block)
+    return h.hexdigest()
+
+
+#**********************End filehash********************
+
+
+class Manifest(object):
+
+    #Purpose: To keep the manifest in fname. entries holds the latest entry of each input file,
+    #keyed by its absolute path.
+
+    def __init__(self,fname):
+        self.fname = fname
+        self.entries = {}
+        numlines = 0
+        if os.path.exists(fname):
+          with open(fname) as f:
+            for line in f:
+              try:
+                entry = json.loads(line)
+              except ValueError:
+                #A line cut short when a run was killed.
+                continue
+              self.entries[entry['input']] = entry
+              numlines += 1
+        #Drop superseded entries so the file doesn't keep growing across reruns.
+        if numlines > len(self.entries):
+          with open(fname+'.tmp','w') as f:
+            for entry in self.entries.values():
+              f.write(json.dumps(entry,sort_keys=True)+'\n')
+          os.rename(fname+'.tmp',fname)
+
+    def fingerprint(self,fname):
+
+        #Purpose: To return the content fingerprint of fname. A file whose size and modification time
+        #are those in its entry isn't read again.
+
+        st = os.stat(fname)
+        entry = self.entries.get(os.path.abspath(fname))
+        if entry is not None and entry['size'] == st.st_size and entry['mtime'] == st.st_mtime:
+          return entry['fingerprint']
+        return filehash(fname)
+
+    def isdone(self,fname,phash):
+
+        #Purpose: To check whether fname was classified with the parameters of hash phash, hasn't
+        #changed since and its output still exists.
+
+        entry = self.entries.get(os.path.abspath(fname))
+        if entry is None or entry['status'] != 'done' or entry['paramhash'] != phash:
+          return False
+        if entry['output'] is None or not os.path.exists(entry['output']):
+          return False
+        try:
+          return self.fingerprint(fname) == entry['fingerprint']
+        except OSError:
+          return False
+
+    def record(self,fname,phash,output,error=None):
+
+        #Purpose: To add the entry for a file that has just been done (error None) or failed (error
+        #is the traceback) and write it to the manifest. Returns the entry.
+
+        key = os.path.abspath(fname)
+        try:
+          st = os.stat(fname)
+          (size,mtime,fingerprint) = (st.st_size,st.st_mtime,filehash(fname))
+        except OSError:
+          (size,mtime,fingerprint) = (None,None,None)
+        entry = {'input':key,'size':size,'mtime':mtime,'fingerprint':fingerprint,'paramhash':phash,
+          'output':None if output is None else os.path.abspath(output),'status':'done' if error is None else 'failed',
+          'error':error,'time':time.strftime('%Y-%m-%dT%H:%M:%S')}
+        self.entries[key] = entry
+        with open(self.fname,'a') as f:
+          f.write(json.dumps(entry,sort_keys=True)+'\n')
+        return entry
+
+
+#**********************End Manifest********************
+
+
+def logfailure(logname,fname,phash,error):
+
+    #Purpose: To append a failure to the log logname, as one JSON line with the time, input file,
+    #parameter hash, the exception (last line of the traceback) and the whole traceback.
+
+    lines = error.strip().splitlines()
+    entry = {'time':time.strftime('%Y-%m-%dT%H:%M:%S'),'input':os.path.abspath(fname),'paramhash':phash,
+      'exception':lines[-1] if len(lines) > 0 else '','traceback':error}
+    with open(logname,'a') as f:
+      f.write(json.dumps(entry,sort_keys=True)+'\n')
+
+
+#**********************End logfailure********************
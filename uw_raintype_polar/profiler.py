@@ -0,0 +1,190 @@
+"""
+ ****Rain-type Classification code of Powell et al. (2016, JTECH): Profiling*****#
+#Description: Instrumentation of the classification. The functions that take a timings dictionary
+#   (batch.processfile, RainTypeClassifier.classify, algorithm.convectivecore, ...) add the wall
+#   time of each stage to it:
+#
+#     read        reading the sweeps (batch.readfile)
+#     masks       getting the masks of the sweep's geometry (built, loaded or already in memory)
+#     background  background reflectivity (algorithm.convsf)
+#     label       labelling echo objects (rtfunctions.echolabels)
+#     cluster     the rest of rtfunctions.makedBZcluster
+#     mixed       the rest of algorithm.convectivecore, mostly the MIXED regions around cores
+#     write       writing the output (batch.writefile)
+#
+#   A Profiler is a timings dictionary that also keeps counts (echo objects, convective cores,
+#   background mask size, ...) and, optionally, the peak memory allocated in each stage, and
+#   sends all of it to sinks (a JSON-lines file, a logger or any function) each time emit is called:
+#
+#   >> prof = profiler.Profiler([profiler.jsonlinessink('profile.jsonl')],memory=True)
+#   >> batch.processfile(fname,params,None,prof)
+#   >> prof.emit(file=fname)
+#
+#   Set profilelog in runraintype.py to log every file of a batch this way. With no timings
+#   dictionary (the default) the stages aren't timed and nothing is counted.
+"""
+from __future__ import division   #For python2 users only.
+import json
+import time
+
+
+class _Stage(object):
+
+    #Times a stage for a plain timings dictionary.
+
+    def __init__(self,timings,name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.time()
+        return self
+
+    def __exit__(self,*exc):
+        self.timings[self.name] = self.timings.get(self.name,0) + time.time()-self.t0
+        return False
+
+
+class _NoStage(object):
+
+    #Does nothing, for when there is no timings dictionary.
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        return False
+
+_nostage = _NoStage()
+
+
+def stage(timings,name):
+
+    #Purpose: To time the code in a with block as stage name. timings is a dictionary (the time
+    #is added to timings[name]), a Profiler, or None for no timing.
+
+    if timings is None:
+      return _nostage
+    if isinstance(timings,Profiler):
+      return timings.stage(name)
+    return _Stage(timings,name)
+
+
+def count(timings,name,n):
+
+    #Purpose: To add n to count name if timings is a Profiler. Plain timings dictionaries only hold
+    #times, so nothing is counted for them (or for None).
+
+    if isinstance(timings,Profiler):
+      timings.counts[name] = timings.counts.get(name,0) + n
+
+
+def counting(timings):
+
+    #Purpose: To check whether counts are kept, so counts that cost something to work out are
+    #only worked out when they are.
+
+    return isinstance(timings,Profiler)
+
+
+#**********************End count********************
+
+
+class Profiler(dict):
+
+    #Purpose: To keep the time (in the dictionary itself, by stage, as any timings dictionary),
+    #counts and, with memory = True, peak memory of each stage until emit sends them to every sink.
+    #A sink is any function taking the record (a dictionary) emit makes. Peak memory is the most
+    #memory allocated through Python (tracemalloc) at any time in the stage, above what was
+    #allocated when it started; tracing memory slows the code down, so it is off by default.
+
+    def __init__(self,sinks=None,memory=False):
+        dict.__init__(self)
+        self.sinks = list(sinks) if sinks is not None else []
+        self.memory = memory
+        self.counts = {}
+        self.peaks = {}
+        if memory:
+          import tracemalloc
+          self._tracemalloc = tracemalloc
+          self._started = not tracemalloc.is_tracing()
+          if self._started:
+            tracemalloc.start()
+
+    def stage(self,name):
+        return _ProfilerStage(self,name)
+
+    def emit(self,**context):
+
+        #Purpose: To send the times, counts and peaks collected since the last emit to the sinks, as
+        #one record with any context given (e.g. file=fname), and start again. Returns the record.
+
+        record = dict(context)
+        record['time'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        record['stages'] = dict(self)
+        record['counts'] = dict(self.counts)
+        if self.memory:
+          record['peak_bytes'] = dict(self.peaks)
+        for sink in self.sinks:
+          sink(record)
+        self.clear()
+        self.counts.clear()
+        self.peaks.clear()
+        return record
+
+    def close(self):
+
+        #Purpose: To stop tracing memory, if this Profiler started it.
+
+        if self.memory and self._started:
+          self._tracemalloc.stop()
+          self._started = False
+
+
+class _ProfilerStage(object):
+
+    #Times a stage, and with memory its peak memory, for a Profiler.
+
+    def __init__(self,prof,name):
+        self.prof = prof
+        self.name = name
+
+    def __enter__(self):
+        if self.prof.memory:
+          self.base = self.prof._tracemalloc.get_traced_memory()[0]
+          self.prof._tracemalloc.reset_peak()
+        self.t0 = time.time()
+        return self
+
+    def __exit__(self,*exc):
+        prof = self.prof
+        prof[self.name] = prof.get(self.name,0) + time.time()-self.t0
+        if prof.memory:
+          peak = prof._tracemalloc.get_traced_memory()[1] - self.base
+          prof.peaks[self.name] = max(prof.peaks.get(self.name,0),peak)
+        return False
+
+
+#**********************End Profiler********************
+
+
+def jsonlinessink(fname):
+
+    #Purpose: To make a sink that appends each record to fname as a line of JSON.
+
+    def sink(record):
+      with open(fname,'a') as f:
+        f.write(json.dumps(record,sort_keys=True,default=str)+'\n')
+    return sink
+
+
+def loggersink(logger,level=20):
+
+    #Purpose: To make a sink that logs each record (as JSON) to logger, at level (INFO by default).
+
+    def sink(record):
+      logger.log(level,'%s',json.dumps(record,sort_keys=True,default=str))
+    return sink
+
+
+#**********************End loggersink********************
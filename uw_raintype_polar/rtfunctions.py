@@ -1,8 +1,12 @@
 from __future__ import division     #For python2 users only.
+import os
+import numpy as np
+from scipy import ndimage as nd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 
 def pol2cart(phi,rho):
   #Just a simple code to convert (azimuth, radius) coordinates to (X,Y) coordinates.
-  import numpy as np
   x = rho * np.cos(phi)
   y = rho * np.sin(phi)
   return(x, y)
@@ -11,7 +15,6 @@ def pol2cart(phi,rho):
 
 
 def radialdistancemask(Xpt,Ypt,X,Y,radius,convradius):
-  import numpy as np
   #csmask is for the mask for MIXED classifications.
   csmask = np.empty([X.shape[0],X.shape[1]])
   csmask[:] = np.nan
@@ -38,82 +41,399 @@ def radialdistancemask(Xpt,Ypt,X,Y,radius,convradius):
 #********End radialdistancemask***************
 
 
-#The following 2 functions are to speed up makedBZcluster. From https://stackoverflow.com/questions/33281957/faster-alternative-to-numpy-where
+def ringmaskindices(Rc,Cc,X,Y,radius,convradius):
+  #Same masks as radialdistancemask for the point at row Rc, column Cc of the (X,Y) grid, but
+  #distances are only computed inside the window of ranges and azimuths that can possibly
+  #be within max(radius,convradius) of that point. Returns the 1D (Fortran-order) indices of the
+  #points in the background mask and in each of the 5 MIXED masks (largest first), in the same
+  #order np.where gives for the full grid.
 
-def compute_M(data):
-  from scipy.sparse import csr_matrix
-  import numpy as np
-  cols = np.arange(data.size)
-  return csr_matrix((cols, (data.ravel(), cols)),
-                    shape=(data.max() + 1, data.size))
+  numRanges = X.shape[0]
+  numTimes = X.shape[1]
+  maxradius = max(radius,convradius)
 
-def get_indices_sparse(data):
-  import numpy as np
-  M = compute_M(data)
-  return [np.unravel_index(row.data, data.shape) for row in M]
+  #X[:,0] is the range of each ring (azimuth 0).
+  rho = X[:,0]
+  rhoc = rho[Rc]
 
-def makedBZcluster(refl,isCore,convsfmat,weakechothres,minsize,maxsize,startslope,shallowconvmin,truncZconvthres,ISO_CONV_FRINGE,WEAK_ECHO,ISO_CS_CORE,CS_CORE,sectorarea,numTimes):
-  import numpy as np
-  from scipy import ndimage as nd
+  #Rings more than maxradius from the center in range can't be in the mask. Pad by one ring for
+  #roundoff; the exact test is done below on the window.
+  i0 = max(np.searchsorted(rho,rhoc-maxradius,'left')-1,0)
+  i1 = min(np.searchsorted(rho,rhoc+maxradius,'right')+1,numRanges)
 
-  #Allocate matrix indicating whether rain is occurring.
-  rain = np.zeros((refl.shape),dtype=np.int)
+  #Along a ring at range r, a point dphi away from the center is at least 2*sqrt(r*rhoc)*sin(dphi/2)
+  #from it, so only azimuths within 2*asin(maxradius/(2*sqrt(rmin*rhoc))) of the center need checking.
+  rmin = rho[i0:i1].min()
+  j0 = 0
+  j1 = numTimes
+  if rmin > 0 and rhoc > 0:
+    s = maxradius/(2*np.sqrt(rmin*rhoc))
+    if s < 1:
+      dphi = 2*np.pi/(2*np.ceil(0.5*numTimes))
+      ncol = int(np.ceil(2*np.arcsin(s)/dphi))+1
+      j0 = max(Cc-ncol,0)
+      j1 = min(Cc+ncol+1,numTimes)
 
-  #If echo is strong enough, rain = 1.
-  rain[refl>=weakechothres] = 1
+  #Distance formula on the window only, exactly as in radialdistancemask.
+  dtemp = np.sqrt((X[Rc,Cc]-X[i0:i1,j0:j1])**2 + (Y[Rc,Cc]-Y[i0:i1,j0:j1])**2)
+
+  masks = [dtemp <= radius] + [dtemp <= convradius-k for k in range(0,5)]
+  indices = []
+  for mask in masks:
+    [I,J] = np.where(mask)
+    indices.append((J+j0)*numRanges + (I+i0))
+
+  return indices
+
+#********End ringmaskindices***************
+
+
+#The following 3 functions keep the background and MIXED masks in an on-disk cache so they
+#are only built once for a given radar geometry. Each cache entry is three .npy files:
+#<key>.idx.npy holds every mask's indices back to back as one integer array,
+#<key>.ptr.npy holds the [start,stop) position of each mask in that array (-1 if the ring
+#has no mask) and <key>.area.npy holds sectorarea. The index and area files are loaded
+#memory-mapped, so they are shared read-only between processes.
+
+def maskcachekey(numRanges,numTimes,kmToFirstGate,kmBetweenGates,backgrndradius,maxConvRadius):
+  #Name of the cache entry for this geometry. repr() keeps the full precision of the floats.
+  key = 'masks_%d_%d_%s_%s_%s_%s' % (numRanges,numTimes,repr(float(kmToFirstGate)),repr(float(kmBetweenGates)),repr(float(backgrndradius)),repr(float(maxConvRadius)))
+  return key
+
+def savemasks(cachedir,key,maskcell,convcell,sectorarea,numRanges,numTimes):
+  if not os.path.isdir(cachedir):
+    os.makedirs(cachedir)
+
+  #Mask indices are offsets within a sweep that has been wrapped to twice its width, so
+  #int32 is plenty unless the sweep is enormous.
+  if 2*numRanges*numTimes < 2**31:
+    dtype = np.int32
+  else:
+    dtype = np.int64
+
+  ptr = -np.ones([numRanges,6,2],dtype=np.int64)
+  chunks = []
+  n = 0
+  for R in range(0,numRanges):
+    if maskcell[R,0] is None:
+      continue
+    masks = [maskcell[R][0]] + [convcell[R,k] for k in range(0,5)]
+    for k in range(0,6):
+      ptr[R,k,:] = [n,n+len(masks[k])]
+      n = n + len(masks[k])
+      chunks.append(masks[k])
+  idx = np.concatenate(chunks).astype(dtype)
+
+  #Write to temporary names and then rename, so a reader never sees a half-written file.
+  for (suffix,data) in (('.idx.npy',idx),('.area.npy',sectorarea),('.ptr.npy',ptr)):
+    fname = os.path.join(cachedir,key+suffix)
+    tmpname = fname + '.%d.tmp' % os.getpid()
+    with open(tmpname,'wb') as f:
+      np.save(f,data)
+    os.rename(tmpname,fname)
+
+def loadmasks(cachedir,key,numRanges,numTimes):
+  idxname = os.path.join(cachedir,key+'.idx.npy')
+  areaname = os.path.join(cachedir,key+'.area.npy')
+  ptrname = os.path.join(cachedir,key+'.ptr.npy')
+  if not (os.path.isfile(idxname) and os.path.isfile(areaname) and os.path.isfile(ptrname)):
+    return None
+  try:
+    ptr = np.load(ptrname)
+    idx = np.load(idxname,mmap_mode='r')
+    sectorarea = np.asarray(np.load(areaname,mmap_mode='r'))
+  except (IOError,ValueError):
+    return None
+  if ptr.shape != (numRanges,6,2) or ptr.max() > len(idx) or sectorarea.shape != (numRanges,numTimes):
+    return None
+
+  #Rebuild maskcell and convcell as views into the memory-mapped index array.
+  idx = np.asarray(idx)
+  maskcell = np.empty([numRanges,1],dtype=object)
+  convcell = np.empty([numRanges,5],dtype=object)
+  for R in range(0,numRanges):
+    if ptr[R,0,0] < 0:
+      continue
+    maskcell[R] = [idx[ptr[R,0,0]:ptr[R,0,1]]]
+    for k in range(0,5):
+      convcell[R,k] = idx[ptr[R,k+1,0]:ptr[R,k+1,1]]
+
+  return(maskcell,convcell,sectorarea)
+
+
+#********End mask cache***************
 
+
+#The following 2 functions compute the mean background Z at every point from the sweep Zsweep
+#(NaNs set to 0). Both return the background as a (numTimes x numRanges) array and, if valid (where
+#Zsweep was not NaN) is given, the number of valid gates in each mean. dtype is the dtype of the
+#background (float32 for reduced precision). If needed (numRanges x numTimes, boolean) is given, the
+#background is only computed where it is True (and may be at a few other gates); it is NaN, and the
+#count 0, elsewhere. Each value computed is the same as without needed.
+#The mask offsets in maskcell are relative to a sweep wrapped to twice its width (half a sweep
+#either side), as the masks used to be applied. Point f of that wrapped sweep (1D, Fortran order)
+#is point (f + numRanges*halfnumTimes) modulo the sweep size of the sweep itself, so the masks are
+#applied to the sweep directly, without making the wrapped copy.
+
+def backgroundgather(Zsweep,valid,maskcell,minR,maxR,numRanges,numTimes,dtype=np.float64,needed=None):
   halfnumTimes = np.int16(np.ceil(0.5*numTimes))
+  size = numRanges*numTimes
 
-  #Wrap matrices around so 0 and 359 degrees are continuous.
-  rain = np.concatenate((rain[:,halfnumTimes:numTimes+1],rain,rain[:,0:halfnumTimes]),axis=1)
-  isCore_minsize = np.concatenate((isCore[:,halfnumTimes:numTimes+1],isCore,isCore[:,0:halfnumTimes]),axis=1)
-  convsfmat_minsize = np.concatenate((convsfmat[:,halfnumTimes:numTimes+1],convsfmat,convsfmat[:,0:halfnumTimes]),axis=1)
+  #Allocate memory.
+  background = np.empty([numTimes,numRanges],dtype=dtype)
+  background[:] = np.nan
+  count = None
+  if valid is not None:
+    count = np.zeros([numTimes,numRanges],dtype=np.int32)
+    valid = np.ravel(valid,order="F")
 
-  #Create truncvalue, which has same shape as reflectivity data. It indicates the 
-  #reflectivity over which an echo is automatically classified as some sort of 
-  #ISOLATED CONVECTIVE echo. See details below.
-  truncvalue = np.ones((isCore_minsize.shape),dtype=np.float64)*truncZconvthres
+  phi = np.array(range(halfnumTimes,halfnumTimes+numTimes))
+  Zsweep = np.ravel(Zsweep,order="F")
+  allcols = np.arange(0,numTimes)
+
+  #With a float32 background, the temporary index array is also halved by using int32 indices
+  #(as long as they fit).
+  itype = None
+  if dtype == np.float32 and 3*size < 2**31:
+    itype = np.int32
+    phi = phi.astype(itype)
+
+  for R in range(minR,maxR+1):
+    #Azimuths of this ring to compute.
+    cols = allcols
+    if needed is not None:
+      cols = np.nonzero(needed[R])[0]
+      if len(cols) == 0:
+        continue
+      if len(cols) == 1 and numTimes > 1:
+        cols = np.array([cols[0],(cols[0]+1) % numTimes])
+    numcols = len(cols)
+    maskuse = maskcell[R][0]
+    if itype is not None:
+      maskuse = maskuse.astype(itype,copy=False)
+    #Azimuths are done in blocks small enough that the temporary arrays are about no larger than
+    #the sweep. Blocks are at least 2 azimuths wide: the mean over a single column is summed in a
+    #different order, which would change the last bits of the result.
+    offset = maskuse + R + numRanges*int(halfnumTimes)
+    numblocks = max(1,min(-(-numcols*len(maskuse)//size),numcols//2))
+    bounds = (np.arange(0,numblocks+1)*numcols)//numblocks
+    for b in range(0,numblocks):
+      c = cols[bounds[b]:bounds[b+1]]
+      index = offset[:,np.newaxis]+numRanges*(phi[c])
+      background[c,R] = np.mean(np.take(Zsweep,index,mode='wrap'),0)
+      if count is not None:
+        count[c,R] = np.sum(np.take(valid,index,mode='wrap'),0)
+
+  return(background,count)
+
+def wrapsum(csum,row,a,b,numTimes):
+  #Sum along azimuth over columns a to b-1 of the given rows, from the running sums csum (numTimes+1
+  #wide, starting with 0). a < numTimes and a <= b <= a+numTimes, with columns past the last
+  #azimuth wrapping around to the first.
+  over = b > numTimes
+  total = csum[row,np.where(over,b-numTimes,b)] - csum[row,a]
+  total[over] = total[over] + np.broadcast_to(csum[row,numTimes],over.shape)[over]
+  return total
+
+def backgroundprefixsum(Zsweep,valid,maskcell,minR,maxR,numRanges,numTimes,dtype=np.float64,needed=None):
+  #The background mask of a ring covers one contiguous run of azimuths on each ring it touches,
+  #so the sum over the mask is a sum of sliding-window sums along azimuth. These come from running
+  #sums, which costs O(rings in the mask) per gate instead of O(points in the mask).
+  halfnumTimes = np.int16(np.ceil(0.5*numTimes))
+
+  background = np.empty([numTimes,numRanges],dtype=dtype)
+  background[:] = np.nan
+  count = np.zeros([numTimes,numRanges],dtype=np.int32)
+
+  #Running sums along azimuth with a leading column of zeros. These are float64 even for a float32
+  #sweep, since a float32 running sum would lose the small values to round-off.
+  csum = np.zeros([numRanges,numTimes+1])
+  np.cumsum(Zsweep,axis=1,out=csum[:,1:])
+  ccount = np.zeros([numRanges,numTimes+1],dtype=np.int64)
+  np.cumsum(valid,axis=1,out=ccount[:,1:])
+
+  allcols = np.arange(0,numTimes)
+  for R in range(minR,maxR+1):
+    #Azimuths of this ring to compute.
+    p = allcols
+    if needed is not None:
+      p = np.nonzero(needed[R])[0]
+      if len(p) == 0:
+        continue
+    maskuse = np.asarray(maskcell[R][0],dtype=np.int64)
+    #Position of every mask point in the wrapped sweep for the first azimuth (phi = halfnumTimes).
+    g = maskuse + R + numRanges*int(halfnumTimes)
+    row = g % numRanges
+    col = g // numRanges
+    #Split the mask into runs of consecutive azimuths on the same ring.
+    order = np.lexsort((col,row))
+    row = row[order]
+    col = col[order]
+    brk = np.ones(len(row),dtype=bool)
+    brk[1:] = (row[1:] != row[:-1]) | (col[1:] != col[:-1]+1)
+    start = np.nonzero(brk)[0]
+    stop = np.append(start[1:],len(row))-1
+    runrow = row[start][:,None]
+    #First azimuth of each run in the sweep itself for every p, and one past its last.
+    c0 = (col[start][:,None]+p+halfnumTimes) % numTimes
+    c1 = c0 + (col[stop]-col[start]+1)[:,None]
+    total = np.sum(wrapsum(csum,runrow,c0,c1,numTimes),0)
+    count[p,R] = np.sum(wrapsum(ccount,runrow,c0,c1,numTimes),0)
+    #An empty mask sums to exactly zero, as with the gather, so it becomes NaN later.
+    total[count[p,R] == 0] = 0
+    background[p,R] = total/len(maskuse)
+
+  if valid is None:
+    count = None
+  return(background,count)
+
+
+#********End background***************
+
+
+def labelechoes(rain,sectorarea,numTimes):
+  #Labels the echo objects (contiguous areas where rain is True, edges touching) of a sweep, with
+  #0 and 359 degrees continuous. Returns the label of each point (0 outside echo objects), the
+  #number of objects and the total area of each (element 0 is the area without echo).
+  #Objects are labelled on the sweep itself and those that touch across 0/359 degrees are joined.
+  #This matches labelling a copy of the sweep wrapped half a sweep either side (as this code used
+  #to) for every object no wider than half a sweep in azimuth. The rare wider objects (e.g. a ring
+  #of echo all the way around the radar) got a different, truncated or doubled area that way, so
+  #then the wrapped copy is still labelled, to keep the classification the same.
+  halfnumTimes = int(np.ceil(0.5*numTimes))
+  area = np.nan_to_num(sectorarea)
 
-  #This is a blob detector. Detects contiguous areas of raining pixels. Diagonally
-  #touching pixels that share a corner don't count. Edges must touch.
-  #echoes contains the blob objects, numechoes is just a count of them.
   (echoes,numechoes) = nd.label(rain)
-  
-  #Get 2D indices of echo objects.
-  K = get_indices_sparse(echoes)
-  K = K[1:] #Exclude echoes==0.
-
-  for i in np.arange(len(K)):
-
-    I = K[i][0] 
-    J = K[i][1]
-
-    #Compute the total areal coverage of the echo object.
-    clusterarea = np.nansum(sectorarea[I,J])    #In km^2
-
-    #Any echo object with a size between minsize and maxsize is considered 
-    #ISOLATED CONVECTION. First, make all of it FRINGE.
-    if clusterarea >= minsize and clusterarea <= maxsize:
-      convsfmat_minsize[I,J] = ISO_CONV_FRINGE 
-
-    #Very small echo objects are dismissed as WEAK ECHO.  
-    if clusterarea < minsize:
-      isCore_minsize[I,J] = 0
-      convsfmat_minsize[I,J] = WEAK_ECHO
-    #Echo objects with size between minsize and startslope get a small truncvalue
-    #equal to shallowconvmin.
-    elif clusterarea >= minsize and clusterarea < startslope:
-      truncvalue[I,J] = shallowconvmin
-    #Echo objects with size between startslope and maxsize get a truncvalue that 
-    #is linearly interpolated between shallowconvmin and truncZconvthres depending
-    #on the size relative to startslope and maxsize.
-    elif clusterarea >= startslope and clusterarea <= maxsize:
-      truncvalue[I,J] = shallowconvmin + ((clusterarea-startslope)/(maxsize-startslope))*(truncZconvthres-shallowconvmin)
-
-  #Unwrap and send variables back to original size.
-  truncvalue = truncvalue[:,halfnumTimes:halfnumTimes+numTimes]
-  isCore = isCore_minsize[:,halfnumTimes:halfnumTimes+numTimes]
-  convsfmat = convsfmat_minsize[:,halfnumTimes:halfnumTimes+numTimes]
+
+  #Join objects that touch across 0/359 degrees.
+  seam = (echoes[:,0] > 0) & (echoes[:,numTimes-1] > 0)
+  if np.any(seam):
+    pairs = coo_matrix((np.ones(np.count_nonzero(seam)),(echoes[seam,0],echoes[seam,numTimes-1])),shape=(numechoes+1,numechoes+1))
+    #Label 0 has no neighbours, so it stays component 0.
+    (numechoes,joined) = connected_components(pairs,directed=False)
+    numechoes = numechoes-1
+    echoes = joined[echoes]
+
+  #Width of each object in azimuth: all azimuths less the widest gap between the azimuths it covers,
+  #going around. Only objects with more points than that limit can be wider than it.
+  limit = numTimes-halfnumTimes+1
+  npoints = np.bincount(echoes.ravel(),minlength=numechoes+1)
+  npoints[0] = 0
+  big = np.nonzero(npoints > limit)[0]
+  wide = False
+  if len(big) > 0:
+    which = -np.ones(numechoes+1,dtype=np.int64)
+    which[big] = np.arange(0,len(big))
+    which = which[echoes]
+    (I,J) = np.nonzero(which >= 0)
+    covered = np.zeros([len(big),numTimes],dtype=bool)
+    covered[which[I,J],J] = True
+    del which,I,J
+    for k in range(0,len(big)):
+      az = np.nonzero(covered[k])[0]
+      gap = np.diff(np.append(az,az[0]+numTimes))-1
+      if numTimes-gap.max() > limit:
+        wide = True
+        break
+
+  if not wide:
+    #Area of each echo object in one pass over the labels (in km^2).
+    clusterarea = np.bincount(echoes.ravel(),weights=area.ravel(),minlength=numechoes+1)
+  else:
+    rain = np.concatenate((rain[:,halfnumTimes:numTimes+1],rain,rain[:,0:halfnumTimes]),axis=1)
+    area = np.concatenate((area[:,halfnumTimes:numTimes+1],area,area[:,0:halfnumTimes]),axis=1)
+    (echoes,numechoes) = nd.label(rain)
+    clusterarea = np.bincount(echoes.ravel(),weights=area.ravel(),minlength=numechoes+1)
+    #The middle of the wrapped copy starts at azimuth 2*halfnumTimes-numTimes (see makedBZcluster).
+    echoes = np.roll(echoes[:,halfnumTimes:halfnumTimes+numTimes],2*halfnumTimes-numTimes,axis=1)
+
+  return(echoes,numechoes,clusterarea)
+
+
+#********End labelechoes***************
+
+
+def echolabels(refl,weakechothres,sectorarea,numTimes):
+
+  #Allocate matrix indicating whether rain is occurring.
+  rain = np.zeros((refl.shape),dtype=bool)
+
+  #If echo is strong enough, rain = 1.
+  rain[refl>=weakechothres] = True
+
+  #This is a blob detector. Detects contiguous areas of raining pixels. Diagonally
+  #touching pixels that share a corner don't count. Edges must touch. Objects continue
+  #across 0 and 359 degrees. echoes contains the blob objects, numechoes is just a count
+  #of them, and clusterarea is the total areal coverage of each (in km^2). Element 0 is the
+  #area without echo, which is never used.
+  return labelechoes(rain,sectorarea,numTimes)
+
+
+#**********************End echolabels********************
+
+
+def makedBZcluster(refl,isCore,convsfmat,weakechothres,minsize,maxsize,startslope,shallowconvmin,truncZconvthres,ISO_CONV_FRINGE,WEAK_ECHO,ISO_CS_CORE,CS_CORE,sectorarea,numTimes,labels=None,backend=None):
+  #isCore and convsfmat are updated in place (unless numTimes is odd) and returned.
+  #labels is (echoes,numechoes,clusterarea) from echolabels, if already made for this refl and
+  #weakechothres (they depend on nothing else); it isn't changed.
+  #backend is a backends.Backend whose cluster kernel applies the values of each echo object to its
+  #points (None for applyobjects).
+
+  if labels is None:
+    labels = echolabels(refl,weakechothres,sectorarea,numTimes)
+  (echoes,numechoes,clusterarea) = labels
+
+  #With an odd number of azimuths, wrapping the sweep half a sweep either side (as this code used
+  #to) returned isCore and convsfmat shifted by one azimuth, as convsf does the background. This is
+  #kept so the classification doesn't change.
+  shift = 2*int(np.ceil(0.5*numTimes)) - numTimes
+  if shift != 0:
+    echoes = np.roll(echoes,-shift,axis=1)
+    isCore = np.roll(isCore,-shift,axis=1)
+    convsfmat = np.roll(convsfmat,-shift,axis=1)
+
+  #Any echo object with a size between minsize and maxsize is considered 
+  #ISOLATED CONVECTION. First, make all of it FRINGE.
+  isfringe = (clusterarea >= minsize) & (clusterarea <= maxsize)
+  #Very small echo objects are dismissed as WEAK ECHO.  
+  isweak = clusterarea < minsize
+  #Echo objects with size between minsize and startslope get a small truncvalue
+  #equal to shallowconvmin.
+  objecttrunc = truncZconvthres*np.ones(numechoes+1)
+  objecttrunc[(clusterarea >= minsize) & (clusterarea < startslope)] = shallowconvmin
+  #Echo objects with size between startslope and maxsize get a truncvalue that 
+  #is linearly interpolated between shallowconvmin and truncZconvthres depending
+  #on the size relative to startslope and maxsize.
+  slope = (clusterarea >= startslope) & (clusterarea <= maxsize)
+  objecttrunc[slope] = shallowconvmin + ((clusterarea[slope]-startslope)/(maxsize-startslope))*(truncZconvthres-shallowconvmin)
+  #Points outside echo objects keep their values.
+  isfringe[0] = False
+  isweak[0] = False
+  objecttrunc[0] = truncZconvthres
+
+  #Look up each point's values by its echo object label.
+  if backend is None:
+    applyobjects(refl,isCore,convsfmat,echoes,isfringe,isweak,objecttrunc,truncZconvthres,ISO_CONV_FRINGE,WEAK_ECHO,ISO_CS_CORE,CS_CORE)
+  else:
+    backend.cluster(refl,isCore,convsfmat,echoes,isfringe,isweak,objecttrunc,truncZconvthres,ISO_CONV_FRINGE,WEAK_ECHO,ISO_CS_CORE,CS_CORE)
+
+  return (convsfmat,isCore)
+
+
+def applyobjects(refl,isCore,convsfmat,echoes,isfringe,isweak,objecttrunc,truncZconvthres,ISO_CONV_FRINGE,WEAK_ECHO,ISO_CS_CORE,CS_CORE):
+  #Updates isCore and convsfmat in place from the values of the echo object (echoes) each point is
+  #in: isfringe, isweak and objecttrunc have one entry per object, as made in makedBZcluster.
+
+  convsfmat[isfringe[echoes]] = ISO_CONV_FRINGE
+  weak = isweak[echoes]
+  isCore[weak] = 0
+  convsfmat[weak] = WEAK_ECHO
+  del weak
+
+  #truncvalue, which has same shape as reflectivity data, indicates the reflectivity
+  #over which an echo is automatically classified as some sort of ISOLATED CONVECTIVE
+  #echo.
+  truncvalue = objecttrunc[echoes]
 
   #Evaluate isCore with size of echo object accounted for.
   #First, if reflectivity exceeds truncvalue, classify it as ISOLATED CONVECTIVE CORE.
@@ -122,4 +442,30 @@ def makedBZcluster(refl,isCore,convsfmat,weakechothres,minsize,maxsize,startslop
   #But if reflectivity exceeds original reflectivity threshold, classify as CONVECTIVE core.
   isCore[ (refl >= truncZconvthres)&(convsfmat != ISO_CONV_FRINGE)] = CS_CORE
 
-  return (convsfmat,isCore)
+
+#**********************End makedBZcluster********************
+
+
+def mixedmask(indexhold,I,maskradius,convcell,shape):
+  #Marks every point within the MIXED mask (convcell) of a convective core on a boolean grid of the
+  #given shape. indexhold is the 1D (Fortran-order) index of each core, I its ring and maskradius
+  #the index into convcell of its mixed radius. Points past 0 or 359 degrees wrap around.
+  size = int(np.prod(shape))
+
+  #Cores on the same ring with the same mixed radius share a mask, so they are handled together, in
+  #blocks small enough that the temporary array of indices is never larger than the sweep.
+  ismixed = np.zeros(size,dtype=bool)
+  (groups,groupof) = np.unique(np.stack((I,maskradius)),axis=1,return_inverse=True)
+  order = np.argsort(np.ravel(groupof),kind='stable')
+  bounds = np.concatenate(([0],np.cumsum(np.bincount(np.ravel(groupof)))))
+  for g in range(0,groups.shape[1]):
+    mask = np.asarray(convcell[groups[0,g],groups[1,g]],dtype=np.int64)
+    cores = indexhold[order[bounds[g]:bounds[g+1]]]
+    blocksize = max(1,size//max(1,len(mask)))
+    for b in range(0,len(cores),blocksize):
+      maskind = cores[b:b+blocksize,None] + mask
+      #Wrap data near 0 or 359 degrees around for continuity.
+      maskind = maskind % size
+      ismixed[maskind.ravel()] = True
+
+  return np.reshape(ismixed,shape,order="F")
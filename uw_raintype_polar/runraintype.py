@@ -14,11 +14,8 @@
 #
 """ 
 from __future__ import division   #For python2 users only. Alternatively, run interpreter with -Q flag.
-import netCDF4 as nc4
-import numpy as np
 import os
-import algorithm as alg
-import cfrad_io as io
+import batch
 import warnings
 
 """
@@ -87,6 +84,7 @@ startslope = 50;          #(in km^2)
 maxsize = 2000;           #(in km^2)
 
 #Reflectivity sweep to base rain-type map on (zero-based 0 = 0.5 deg for SPOL or 0.8 deg for Revelle). sweep_used = 0 means use the lowest elevation angle available. 
+#To classify several sweeps of each file in one pass, set sweep_used to a list of sweeps (e.g. [0,1,2]) or to 'ppi' for every PPI sweep. All of them are written to one output file.
 sweep_used = 0
 
 #Names of key input variables. SPOL during DYNAMO was dual-pol, so LDR is available. 
@@ -102,14 +100,112 @@ clutterName = 'CMD_FLAG_S'
 fileDir = '../example/';
 fileDirOut = './';
 
-#Only set repeatmask to 0 or 1. Set repeatmask to 0 if all files in the batch have the same spacing in azimuth and range AND the dimensions numRanges and numTimes in the first file of your batch are as large as they will be in any file. Otherwise, make repeatmask = 1. Setting repeatmask = 0 will make the code will run faster by about 30%. If you're not sure what to do, set repeatmask = 1 to be safe. If only running one file at a time, repeatmask is irrelevant.
-repeatmask = 1
+#Only set repeatmask to 0 or 1. Set repeatmask to 0 to keep the masks in memory and reuse them for later files. Masks are kept per radar geometry, so this is safe even if files in the batch have different spacing in azimuth and range or different dimensions. Setting repeatmask = 0 will make the code will run faster by about 30%. With repeatmask = 1, masks are loaded from maskcacheDir (or rebuilt) for every file. If only running one file at a time, repeatmask is irrelevant.
+repeatmask = 0
+
+#Directory in which to cache the background and MIXED masks between runs. Masks are keyed by the radar
+#geometry (numRanges, numTimes, gate spacing, range to first gate, backgrndradius and maxConvRadius), so
+#with a cache the masks are only built the first time a geometry is seen, even across runs. Set to None to
+#build the masks for each run without caching them.
+maskcacheDir = './maskcache/'
+
+#How background reflectivity is computed. 'gather' averages the data under each point's background mask
+#directly. 'prefixsum' gets the same averages (to floating-point tolerance) from running sums along azimuth
+#and is much faster for large backgrndradius or fine gate spacing.
+bgengine = 'gather'
+
+#Which code runs the background, echo-object and MIXED-region kernels (see backends.py). 'reference' is the
+#NumPy code. 'numba' compiles them with Numba (if it is installed) and runs them on several threads (set the
+#number with the NUMBA_NUM_THREADS environment variable; with nworkers > 1, keep nworkers times the threads
+#within the number of cores). Its background agrees with the reference one to floating-point tolerance, as
+#with bgengine = 'prefixsum'. 'auto' uses 'numba' if it is installed and 'reference' otherwise.
+backend = 'reference'
+
+#With cropecho = True, a sweep with no echo of at least weakechothres (clear air) is classified without
+#computing the background, and for other sweeps the background is only computed around the echo, which is
+#all the algorithm uses. The classification is the same as with cropecho = False, which computes it everywhere.
+#This saves time, not memory: the sweep, the background (NaN away from the echo), the core and class grids and
+#the echo objects are still whole-sweep arrays, as the echo objects and MIXED regions can span the sweep. Only
+#the convective-core test is done on the echo gates alone (whether cropecho is set or not).
+cropecho = True
+
+#Set packedrefl to 1 to read reflectivity stored as 8- or 16-bit integers (with scale_factor and add_offset)
+#as the stored integers and convert them to dBZ and Z with lookup tables, which is faster than unpacking it
+#and computing Z for every gate. For reflectivity stored 1D (ray_start_index and ray_n_gates) it gives the
+#same result. For 2D reflectivity it changes the output. Read as usual, 2D data is unpacked to float32 and
+#missing gates are masked with the fill value as their data: that value goes into the background sums as
+#their Z (lowering, or NaNing, the background of nearby gates), and the gates themselves are classified
+#WEAK_ECHO, or MIXED near a convective core. With packedrefl = 1 missing gates are NaN, as for 1D data, so
+#they are left out of the background and classified NO_ECHO, and the background elsewhere differs by up to a
+#few 1e-5 dBZ from the float32 unpacking. Reflectivity stored any other way is read as usual.
+packedrefl = 0
+
+#Set precision to 'single' to compute in float32 (with int8 classes) instead of float64. This cuts the
+#memory used per sweep (peak memory by about a quarter for large sweeps). The background differs from the float64 one by up to a few 1e-5 dBZ (see
+#convectivecore in algorithm.py), which very rarely changes the class of a gate.
+precision = 'double'
+
+#How the rain type is written. rtdtype is the integer type of the raintype field ('int8' holds every class and
+#rtfill in a quarter of the space of 'int32'). complevel (0 to 9) sets zlib compression of the field, and
+#shuffle = True adds the shuffle filter, which helps zlib with the wider integer types. The field is stored
+#in chunks of chunkrays whole rays (None for one sweep per chunk when compressed). Set coordprecision to
+#'single' to store range, azimuth, elevation and fixed_angle as float32. The defaults write the same files
+#as earlier versions of this code.
+rtdtype = 'int32'
+complevel = 0
+shuffle = False
+chunkrays = None
+coordprecision = 'double'
+
+#Set appendsource to 1 to add the raintype field to each input file instead of writing a new file to
+#fileDirOut with a copy of the metadata. The input files are then modified in place.
+appendsource = 0
+
+#To collect a whole campaign in one file, set campaignfile to the name of a NetCDF4 campaign store (e.g.
+#fileDirOut+'campaign_raintype.nc'). Each classified sweep is then appended to it, along with its time and
+#geometry, instead of a file being written per volume (see campaign.py for reading it back). The store is
+#created with the raintype storage options above if it doesn't exist. Set to None for one file per volume.
+campaignfile = None
+
+#If only statistics of the rain type are wanted, set statsfile to the name of a .npz file. The area of each
+#class, the CONVECTIVE and MIXED area of every sweep and the area of each class in range rings statsringkm
+#km wide (all weighted by the area of each gate) are then collected over the batch and saved there, and no
+#file is written per volume (see stats.py). Set to None to write the rain type as usual.
+statsfile = None
+statsringkm = 1.0
+
+#Set manifestfile to the name of a file in which to record every input file classified (with a fingerprint
+#of its contents, the parameters used and its output file). Files already done with the same parameters,
+#unchanged and with their output still there are then skipped when the batch is run again, and files that
+#failed are retried, so rerunning after a crash or after adding files only classifies what is left. If
+#failurelog is also set, the errors of the files that fail are appended to it, one JSON line per failure.
+#Set both to None to classify every file every time.
+manifestfile = None
+failurelog = None
+
+#Set profilelog to the name of a file to log, for every file classified, the time spent in each stage (reading,
+#masks, background, labelling echo objects, clustering, MIXED regions and writing) and counts such as the
+#number of echo objects and convective cores, one JSON line per file (see profiler.py). Set profilememory to
+#True to log the peak memory of each stage too, which slows the code down. Set profilelog to None for no log.
+profilelog = None
+profilememory = False
 
 title = 'Rain type classification of DYNAMO SPolKa radar data in polar coordinates';
 institution = 'University of Washington';
 source = 'Code used https://github.com/swpowell/raintype_python_polar';
 references = 'http://www.atmos.uw.edu/MG/PDFs/JTECH16_Powell-etal_RainCat.pdf';
 
+#Number of worker processes to spread the files over. With nworkers > 1 the masks for every geometry in
+#the batch are computed first and shared read-only with the workers through maskcacheDir (or a temporary
+#directory if maskcacheDir is None).
+nworkers = 1
+
+#With nworkers = 1, set pipelinedepth to 1 or more to read the next files and write the finished ones in
+#threads while a file is classified, so the disk and the processor are both kept busy. Up to pipelinedepth
+#volumes wait to be classified and as many to be written, which bounds the memory used. 0 does each file
+#in turn.
+pipelinedepth = 0
+
 ## *****************  END USER INPUT PARAMETERS *****************
 
 ## *****************  BEGIN OUTPUT CONSTANTS *****************
@@ -129,42 +225,30 @@ WEAK_ECHO = 6;
 
 ## ***************** END OUTPUT CONSTANTS   ******************
 
-# We need to make sure that the convsf file starts at sweep_number zero
-# with start_ray_index = 0 and end_ray_index = num rays in sweep minus one
-# This may need modification if we output multi-sweep convsf file.
-sweep_number_out = 0;
-start_index_out = 0;
-
-sdir = os.listdir(fileDir)
-numfiles = len(sdir)
-
-#This for-loop assumes the code is being run on a batch of several input files. Each file will be
-#processed in the order it appears in the directory.
-for m in range(0,numfiles):
+rtfill = -99 #Set fill value for rain-type (mainly for outer ring of unclassified data)
 
-    try:
+#All of the parameters above, as passed to the batch functions.
+params = dict(minZdiff=minZdiff,deepcoszero=deepcoszero,shallowconvmin=shallowconvmin,truncZconvthres=truncZconvthres,
+  dBZformaxconvradius=dBZformaxconvradius,mindbzuse=mindbzuse,weakechothres=weakechothres,backgrndradius=backgrndradius,
+  maxConvRadius=maxConvRadius,minsize=minsize,startslope=startslope,maxsize=maxsize,sweep_used=sweep_used,
+  reflName=reflName,ldrName=ldrName,clutterName=clutterName,fileDirOut=fileDirOut,repeatmask=repeatmask,
+  maskcacheDir=maskcacheDir,bgengine=bgengine,backend=backend,cropecho=cropecho,packedrefl=packedrefl,precision=precision,rtdtype=rtdtype,complevel=complevel,shuffle=shuffle,chunkrays=chunkrays,
+  coordprecision=coordprecision,appendsource=appendsource,campaignfile=campaignfile,statsfile=statsfile,
+  statsringkm=statsringkm,manifestfile=manifestfile,failurelog=failurelog,
+  profilelog=profilelog,profilememory=profilememory,pipelinedepth=pipelinedepth,title=title,institution=institution,source=source,references=references,
+  CS_CORE=CS_CORE,ISO_CS_CORE=ISO_CS_CORE,NO_ECHO=NO_ECHO,STRATIFORM=STRATIFORM,CONVECTIVE=CONVECTIVE,MIXED=MIXED,
+  ISO_CONV_CORE=ISO_CONV_CORE,ISO_CONV_FRINGE=ISO_CONV_FRINGE,WEAK_ECHO=WEAK_ECHO,rtfill=rtfill)
 
-        #Filename for input
-        fname = fileDir + sdir[m]
-        print(fname)
-        #Read in CF/Radial file
-        (sls_size,sweep_number1,volume_number1,time_coverage_start1,time_coverage_end1,starttime,lat1,lon1,alt1,sweep_mode1,fixed_angle1,time1,range1,azimuth1,elevation1,ssri1,seri1,meterstoFirstGate,metersBetweenGates,kmToFirstGate,kmBetweenGates,sweep_start_ray_index,sweep_end_ray_index,ins_name,ncid) = io.readcfrad(fname,sweep_used,reflName,ldrName,clutterName)
-
-        #Read designated sweep
-        (dBZsweep,numRanges,numTimes) = io.readsweep(ncid,sweep_start_ray_index,sweep_end_ray_index,sweep_used,fixed_angle1,reflName,ldrName,clutterName)
+if __name__ == '__main__':
 
-        #Set up masks for background and mixed region + compute background reflectivities
-        if m == 0 or repeatmask == 1:
-          (maskcell,convcell,background,sectorarea,dBZsweep,minR,maxR) = alg.convsf(kmToFirstGate,kmBetweenGates,numRanges,numTimes,backgrndradius,maxConvRadius,sweep_used,dBZsweep,m,repeatmask,None)
-        else:
-          (background,dBZsweep,minR,maxR) = alg.convsf(kmToFirstGate,kmBetweenGates,numRanges,numTimes,backgrndradius,maxConvRadius,sweep_used,dBZsweep,m,repeatmask,maskcell)
+    sdir = os.listdir(fileDir)
 
-        #Run the algorithm. 
-        rtfill = -99 #Set fill value for rain-type (mainly for outer ring of unclassified data)
-        raintype = alg.convectivecore(background,dBZsweep,minZdiff,CS_CORE,ISO_CS_CORE,CONVECTIVE,STRATIFORM,MIXED,WEAK_ECHO,ISO_CONV_CORE,ISO_CONV_FRINGE,NO_ECHO,dBZformaxconvradius,maxConvRadius,weakechothres,deepcoszero,minsize,maxsize,startslope,shallowconvmin,truncZconvthres,mindbzuse,sectorarea,convcell,maxR,numRanges,numTimes,rtfill)
+    #Each file will be processed in the order it appears in the directory (spread over nworkers
+    #processes if nworkers > 1). Results come back in the same order.
+    fnames = [fileDir + sdir[m] for m in range(0,len(sdir))]
+    results = batch.runbatch(fnames,params,nworkers)
 
-        #Write the data to a new CF/Radial file that is viewable in CIDD.  
-        io.writecfrad(fileDirOut,sdir[m],raintype,sls_size,volume_number1,time_coverage_start1,time_coverage_end1,lat1,lon1,alt1,sweep_number1,sweep_mode1,sweep_used,fixed_angle1,ssri1,seri1,time1,numTimes,range1,meterstoFirstGate,metersBetweenGates,azimuth1,elevation1,rtfill,starttime,ins_name,title,institution,source,references)
-
-    except:
-        Warning(str('Something went wrong processing this file! ' + fileDir + sdir[m])) 
+    for (fname,outname,error) in results:
+        print(fname)
+        if error is not None:
+            warnings.warn(str('Something went wrong processing this file! ' + fname + '\n' + error))
@@ -0,0 +1,135 @@
+"""
+ ****Rain-type Classification code of Powell et al. (2016, JTECH): Rain-type statistics*****#
+#Description: RainTypeStats accumulates statistics of the rain type of any number of sweeps
+#   without keeping the sweeps: the area covered by each class, the CONVECTIVE and MIXED area of
+#   every sweep (a time series), and the area of each class in range rings, all weighted by the
+#   area of each gate (sectorarea). Statistics from different workers or runs are combined with
+#   merge, so a climatology can be built in pieces.
+#
+#   >> s = stats.RainTypeStats()
+#   >> s.update(raintype,sectorarea,kmToFirstGate,kmBetweenGates,time)
+#   >> s.merge(other)
+#   >> s.fractions()          #Fraction of the classified area in each class
+#   >> s.save('stats.npz')
+#
+#   Set statsfile in runraintype.py to collect these statistics for a batch instead of writing
+#   a file per volume.
+"""
+from __future__ import division   #For python2 users only.
+import numpy as np
+
+
+class RainTypeStats(object):
+
+    #Purpose: To accumulate rain-type statistics. numclasses is the number of classes counted (codes
+    #0 to numclasses-1, 0 to WEAK_ECHO by default). Gates with rtfill or any other code are not
+    #counted. Range rings are ringkm wide, starting at the radar.
+
+    def __init__(self,numclasses=7,ringkm=1.0,CONVECTIVE=2,MIXED=3):
+        self.numclasses = numclasses
+        self.ringkm = ringkm
+        self.CONVECTIVE = CONVECTIVE
+        self.MIXED = MIXED
+        #Total area (km^2) of each class, and of each class in each ring (rings x classes).
+        self.classarea = np.zeros(numclasses)
+        self.ringarea = np.zeros([0,numclasses])
+        #One entry per sweep: time, CONVECTIVE area, MIXED area, classified area and where it came from.
+        self.time = []
+        self.convarea = []
+        self.mixedarea = []
+        self.totalarea = []
+        self.label = []
+
+    def update(self,raintype,sectorarea,kmToFirstGate,kmBetweenGates,time=np.nan,label=''):
+
+        #Purpose: To add a (range x azimuth) rain-type sweep, with sectorarea (km^2 of each gate, from
+        #algorithm.getmasks) the same shape. time and label are kept with the sweep's entry in the
+        #time series.
+
+        raintype = np.asarray(raintype)
+        numRanges = raintype.shape[0]
+        counted = (raintype >= 0) & (raintype < self.numclasses)
+        classes = raintype[counted].astype(np.intp)
+        area = np.broadcast_to(sectorarea,raintype.shape)[counted]
+
+        #Ring of each range gate, by the distance to its center.
+        ring = np.floor((kmToFirstGate + kmBetweenGates*np.arange(0,numRanges))/self.ringkm).astype(np.intp)
+        numrings = int(ring[-1])+1
+        if numrings > self.ringarea.shape[0]:
+          self.ringarea = np.concatenate((self.ringarea,np.zeros([numrings-self.ringarea.shape[0],self.numclasses])))
+        ringclass = np.broadcast_to(ring[:,None],raintype.shape)[counted]*self.numclasses + classes
+        ringarea = np.bincount(ringclass,area,numrings*self.numclasses).reshape(numrings,self.numclasses)
+        self.ringarea[0:numrings] += ringarea
+
+        classarea = ringarea.sum(0)
+        self.classarea += classarea
+        self.time.append(float(time))
+        self.convarea.append(classarea[self.CONVECTIVE])
+        self.mixedarea.append(classarea[self.MIXED])
+        self.totalarea.append(classarea.sum())
+        self.label.append(str(label))
+
+    def merge(self,other):
+
+        #Purpose: To add the statistics of other (e.g. from another worker) to these. The time series
+        #is kept in time order. Returns self.
+
+        if other.numclasses != self.numclasses or other.ringkm != self.ringkm:
+          raise ValueError('Can only merge statistics with the same classes and ring width.')
+        self.classarea += other.classarea
+        numrings = max(self.ringarea.shape[0],other.ringarea.shape[0])
+        ringarea = np.zeros([numrings,self.numclasses])
+        ringarea[0:self.ringarea.shape[0]] += self.ringarea
+        ringarea[0:other.ringarea.shape[0]] += other.ringarea
+        self.ringarea = ringarea
+        order = np.argsort(np.array(self.time + other.time),kind='stable')
+        for name in ('time','convarea','mixedarea','totalarea','label'):
+          merged = getattr(self,name) + getattr(other,name)
+          setattr(self,name,[merged[k] for k in order])
+        return self
+
+    def fractions(self):
+
+        #Purpose: To return the fraction of the total classified area in each class.
+
+        return self.classarea/max(self.classarea.sum(),1e-300)
+
+    def ringfrequency(self):
+
+        #Purpose: To return (ringkm, frequency), where ringkm is the inner edge of each ring and
+        #frequency (rings x classes) is the fraction of the classified area of each ring in each
+        #class (NaN for rings with nothing classified).
+
+        total = self.ringarea.sum(1)[:,None]
+        with np.errstate(invalid='ignore',divide='ignore'):
+          frequency = np.where(total > 0,self.ringarea/total,np.nan)
+        return (self.ringkm*np.arange(0,self.ringarea.shape[0]),frequency)
+
+    def save(self,fname):
+
+        #Purpose: To save the statistics to a .npz file that load reads back.
+
+        np.savez(fname,numclasses=self.numclasses,ringkm=self.ringkm,CONVECTIVE=self.CONVECTIVE,MIXED=self.MIXED,
+          classarea=self.classarea,ringarea=self.ringarea,time=np.array(self.time,dtype=np.float64),
+          convarea=np.array(self.convarea,dtype=np.float64),mixedarea=np.array(self.mixedarea,dtype=np.float64),
+          totalarea=np.array(self.totalarea,dtype=np.float64),label=np.array(self.label,dtype=str))
+
+
+#**********************End RainTypeStats********************
+
+
+def load(fname):
+
+    #Purpose: To read statistics saved by RainTypeStats.save.
+
+    with np.load(fname) as f:
+      s = RainTypeStats(int(f['numclasses']),float(f['ringkm']),int(f['CONVECTIVE']),int(f['MIXED']))
+      s.classarea = f['classarea']
+      s.ringarea = f['ringarea']
+      for name in ('time','convarea','mixedarea','totalarea','label'):
+        setattr(s,name,f[name].tolist())
+
+    return s
+
+
+#**********************End load********************
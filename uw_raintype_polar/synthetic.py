@@ -0,0 +1,126 @@
+"""
+ ****Rain-type Classification code of Powell et al. (2016, JTECH): Synthetic CfRadial data*****#
+#Description: Functions for making synthetic reflectivity sweeps and writing them as CfRadial
+#   files with the variables readcfrad and readsweep expect. Used to exercise the batch, watch
+#   and benchmark code without real radar data.
+"""
+from __future__ import division   #For python2 users only.
+import numpy as np
+import netCDF4 as nc4
+
+
+def makesweep(numRanges,numTimes,kmBetweenGates,kmToFirstGate,seed=0,numcells=60,shieldradius=25,numshields=1):
+
+    #Purpose: To make a (numRanges x numTimes) reflectivity sweep in dBZ (NaN where there is no echo)
+    #with numshields stratiform shields of radius shieldradius km, light echo around the radar and
+    #numcells isolated convective cells scattered over the domain. Echo coverage is set by the number
+    #and size of the shields and the number of cells.
+
+    rng = np.random.RandomState(seed)
+    maxrange = kmToFirstGate+kmBetweenGates*numRanges
+
+    #Cartesian coordinates of every gate.
+    R = kmToFirstGate + kmBetweenGates*np.arange(0,numRanges)[:,None]
+    phi = 2*np.pi*np.arange(0,numTimes)[None,:]/numTimes
+    X = R*np.cos(phi)
+    Y = R*np.sin(phi)
+
+    dBZ = np.empty([numRanges,numTimes])
+    dBZ[:] = np.nan
+
+    #Stratiform shields, centered somewhere inside the domain.
+    for k in range(0,numshields):
+      (xc,yc) = rng.uniform(-0.5*maxrange,0.5*maxrange,2)
+      shield = np.hypot(X-xc,Y-yc) < shieldradius
+      dBZ[shield] = 20 + 5*rng.standard_normal(np.count_nonzero(shield))
+
+    #Light echo near the radar.
+    near = np.broadcast_to(R < min(6,0.1*maxrange),dBZ.shape)
+    dBZ[near] = 15 + 3*rng.standard_normal(np.count_nonzero(near))
+
+    #Isolated cells, peaked in the middle.
+    for k in range(0,numcells):
+      (xc,yc) = rng.uniform(-maxrange,maxrange,2)
+      radius = rng.uniform(0.5,4)
+      peak = rng.uniform(25,55)
+      d = np.hypot(X-xc,Y-yc)
+      cell = d < radius
+      dBZ[cell] = np.fmax(dBZ[cell],peak*(1-0.5*d[cell]/radius))
+
+    return dBZ
+
+
+#**********************End makesweep********************
+
+
+def writesynthetic(fname,dBZ,kmBetweenGates,kmToFirstGate,reflName='DBZ_S',ragged=False,numsweeps=1,starttime='2011-10-01T00:00:00Z'):
+
+    #Purpose: To write dBZ as a CfRadial file with numsweeps identical PPI sweeps. With ragged = True
+    #the reflectivity is stored 1D with ray_start_index and ray_n_gates, otherwise 2D (time x range).
+
+    numRanges = dBZ.shape[0]
+    numTimes = dBZ.shape[1]
+    sls_size = 32
+    fill = -9999.
+
+    ncid = nc4.Dataset(fname,'w',format='NETCDF4')
+    ncid.Conventions = "CF/Radial"
+    ncid.instrument_name = "SYNTHETIC"
+
+    ncid.createDimension('time',numTimes*numsweeps)
+    ncid.createDimension('range',numRanges)
+    ncid.createDimension('sweep',numsweeps)
+    ncid.createDimension('string_length_short',sls_size)
+
+    def chars(s):
+      return np.array(list(s.ljust(sls_size)),dtype='S1')
+
+    vn = ncid.createVariable('volume_number',np.int32)
+    vn[:] = 0
+    tcs = ncid.createVariable('time_coverage_start','S1',('string_length_short'))
+    tcs[:] = chars(starttime)
+    tce = ncid.createVariable('time_coverage_end','S1',('string_length_short'))
+    tce[:] = chars(starttime)
+    for (name,value) in (('latitude',0.),('longitude',0.),('altitude',0.)):
+      var = ncid.createVariable(name,np.double)
+      var[:] = value
+    sweep_number = ncid.createVariable('sweep_number',np.int32,('sweep'))
+    sweep_number[:] = np.arange(0,numsweeps)
+    sweep_mode = ncid.createVariable('sweep_mode','S1',('sweep','string_length_short'))
+    sweep_mode[:] = np.array([chars('azimuth_surveillance')]*numsweeps)
+    fixed_angle = ncid.createVariable('fixed_angle',np.float32,('sweep'))
+    fixed_angle[:] = 0.5 + np.arange(0,numsweeps)
+    ssri = ncid.createVariable('sweep_start_ray_index',np.int32,('sweep'))
+    ssri[:] = numTimes*np.arange(0,numsweeps)
+    seri = ncid.createVariable('sweep_end_ray_index',np.int32,('sweep'))
+    seri[:] = numTimes*np.arange(0,numsweeps) + numTimes - 1
+    timevar = ncid.createVariable('time',np.double,('time'))
+    timevar[:] = 0.1*np.arange(0,numTimes*numsweeps)
+    rangevar = ncid.createVariable('range',np.float32,('range'))
+    rangevar[:] = 1000*(kmToFirstGate + kmBetweenGates*np.arange(0,numRanges))
+    rangevar.meters_to_center_of_first_gate = 1000*kmToFirstGate
+    rangevar.meters_between_gates = 1000*kmBetweenGates
+    azi = ncid.createVariable('azimuth',np.float32,('time'))
+    azi[:] = np.tile(360*np.arange(0,numTimes)/numTimes,numsweeps)
+    elev = ncid.createVariable('elevation',np.float32,('time'))
+    elev[:] = np.repeat(0.5 + np.arange(0,numsweeps),numTimes)
+
+    data = np.tile(np.transpose(dBZ),(numsweeps,1))
+    data[np.isnan(data)] = fill
+    if ragged:
+      ncid.createDimension('n_points',data.size)
+      rsi = ncid.createVariable('ray_start_index',np.int32,('time'))
+      rsi[:] = numRanges*np.arange(0,numTimes*numsweeps)
+      rng = ncid.createVariable('ray_n_gates',np.int32,('time'))
+      rng[:] = numRanges
+      refl = ncid.createVariable(reflName,np.float32,('n_points'),fill_value=fill)
+      refl[:] = np.ravel(data)
+    else:
+      refl = ncid.createVariable(reflName,np.float32,('time','range'),fill_value=fill)
+      refl[:,:] = data
+    refl.units = "dBZ"
+
+    ncid.close()
+
+
+#**********************End writesynthetic********************
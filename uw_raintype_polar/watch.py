@@ -0,0 +1,124 @@
+"""
+ ****Rain-type Classification code of Powell et al. (2016, JTECH): Real-time watch mode*****#
+#Description: A long-running loop that watches an input directory and classifies each new
+#   CfRadial volume as soon as it has finished arriving. Modules, masks and parameters stay
+#   in memory between volumes, outputs are written atomically (see batch.writefile), and the
+#   end-to-end latency of every volume is logged along with the time spent reading, computing
+#   the background, clustering echo objects, assigning MIXED regions and writing.
+#
+#   To run with the parameters in runraintype.py:
+#
+#   >> python -W ignore watch.py
+#
+#   To try it out, start it on an empty directory and drop files made with
+#   synthetic.writesynthetic into that directory.
+"""
+from __future__ import division   #For python2 users only.
+import logging
+import os
+import time
+import batch
+
+logger = logging.getLogger('raintype.watch')
+
+#Stages logged for each file, in order (see profiler.py).
+STAGES = ('read','masks','background','label','cluster','mixed','write')
+
+
+def _landed(fileDir,seen,sizes):
+
+    #Purpose: To list the files in fileDir that haven't been processed yet and have stopped
+    #growing since the last look (so are done being written), oldest first. sizes holds the
+    #(size, modification time) of each pending file from the last look and is updated here.
+
+    ready = []
+    for name in os.listdir(fileDir):
+      #Skip hidden and partly written files.
+      if name in seen or name.startswith('.') or name.endswith('.part') or name.endswith('.tmp'):
+        continue
+      fname = os.path.join(fileDir,name)
+      try:
+        st = os.stat(fname)
+      except OSError:
+        continue
+      if not os.path.isfile(fname):
+        continue
+      stamp = (st.st_size,st.st_mtime)
+      if sizes.get(name) == stamp:
+        ready.append((st.st_mtime,name))
+      sizes[name] = stamp
+
+    ready.sort()
+    return [name for (mtime,name) in ready]
+
+
+def watch(fileDir,params,pollinterval=1.0,maxfiles=None,timeout=None,existing=False):
+
+    #Purpose: To classify new files in fileDir as they arrive until maxfiles files have been
+    #processed or no file has arrived for timeout seconds (if either is given; otherwise forever).
+    #Files already in fileDir at startup are skipped unless existing is True. Returns a list with
+    #one (input file, output file, error, latency, timings) tuple per file, in the order processed.
+    #latency is the time from when the file was last modified to when its output was complete (None
+    #if it failed), and timings has the time spent in each stage. With params['profilelog'] set,
+    #latency is logged with each file's record as well.
+
+    masks = {}
+    #With params['profilelog'] set, the stages of every file are also logged there (see profiler.py).
+    profiler = batch.newprofiler(params)
+    seen = set()
+    sizes = {}
+    results = []
+    if not existing:
+      seen.update(os.listdir(fileDir))
+
+    lastarrival = time.time()
+    while maxfiles is None or len(results) < maxfiles:
+      names = _landed(fileDir,seen,sizes)
+      if len(names) == 0:
+        if timeout is not None and time.time()-lastarrival > timeout:
+          break
+        time.sleep(pollinterval)
+        continue
+
+      for name in names:
+        fname = os.path.join(fileDir,name)
+        seen.add(name)
+        del sizes[name]
+        if profiler is not None:
+          timings = profiler
+        else:
+          timings = {}
+        latency = None
+        try:
+          arrived = os.stat(fname).st_mtime
+          outname = batch.processfile(fname,params,masks,timings)
+          error = None
+          latency = time.time()-arrived
+        except Exception as e:
+          outname = None
+          error = str(e)
+          logger.exception('Something went wrong processing this file! %s',fname)
+        else:
+          #Sweeps with no echo skip most stages (see RainTypeClassifier.noecho), so only the stages
+          #that ran are logged.
+          stages = ', '.join('%s %.3f' % (s,timings[s]) for s in STAGES if s in timings)
+          logger.info('%s: latency %.3f s (%s)',name,latency,stages)
+        results.append((fname,outname,error,latency,dict(timings)))
+        if profiler is not None:
+          profiler.emit(file=fname,failed=error is not None,latency=latency)
+        lastarrival = time.time()
+        if maxfiles is not None and len(results) >= maxfiles:
+          break
+
+    if profiler is not None:
+      profiler.close()
+    return results
+
+
+#**********************End watch********************
+
+
+if __name__ == '__main__':
+    import runraintype
+    logging.basicConfig(level=logging.INFO,format='%(asctime)s %(message)s')
+    watch(runraintype.fileDir,runraintype.params)